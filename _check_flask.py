@@ -1,13 +1,18 @@
 import os
 os.environ.setdefault("DEV_MODE", "true")
 
+import orjson
+
 from webapp.app import app
 
+
 def main():
+    # app already uses the orjson JSON provider from webapp.app
     c = app.test_client()
-    r0 = c.post('/api/count', json={'user_id': 123})
-    r1 = c.post('/api/click', json={'user_id': 123})
-    r2 = c.post('/api/count', json={'user_id': 123})
+    body = orjson.dumps({'user_id': 123})
+    r0 = c.post('/api/count', data=body, content_type='application/json')
+    r1 = c.post('/api/click', data=body, content_type='application/json')
+    r2 = c.post('/api/count', data=body, content_type='application/json')
     print('COUNT0=', r0.get_json())
     print('CLICK1=', r1.get_json())
     print('COUNT1=', r2.get_json())
@@ -0,0 +1,62 @@
+import asyncio
+import contextlib
+import os
+import time
+from typing import AsyncIterator, Awaitable
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from dotenv import load_dotenv
+
+
+class TokenBucket:
+    """Async token bucket that paces Bot API calls under Telegram's ~30 msg/s limit"""
+
+    def __init__(self, rate: float = 30, burst: int = 30):
+        self._rate = rate
+        self._capacity = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self._rate)
+
+
+# The limit is per bot token, so the bot and the scheduler share this bucket
+# when main.py runs them in one process
+telegram_bucket = TokenBucket()
+
+
+@contextlib.asynccontextmanager
+async def bot_ctx() -> AsyncIterator[Bot]:
+    """Yield a Bot for one-shot scripts and close its HTTP session on exit"""
+    load_dotenv()
+    token = os.getenv("BOT_TOKEN")
+    if not token:
+        raise RuntimeError("BOT_TOKEN is missing in .env")
+    # One-shot scripts make a couple of calls, a small pool is enough
+    bot = Bot(token, session=AiohttpSession(limit=4))
+    try:
+        yield bot
+    finally:
+        await bot.session.close()
+
+
+def run(coro: Awaitable) -> None:
+    """asyncio.run() on uvloop when it is installed (it is not available on Windows)"""
+    try:
+        import uvloop
+    except ImportError:
+        asyncio.run(coro)
+        return
+    with asyncio.Runner(loop_factory=uvloop.new_event_loop) as runner:
+        runner.run(coro)
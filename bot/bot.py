@@ -1,176 +1,703 @@
 import asyncio
+import hashlib
+import hmac
 import logging
-from logging.handlers import RotatingFileHandler
+from logging.handlers import MemoryHandler, QueueHandler, QueueListener, RotatingFileHandler
 import os
-from datetime import datetime
+import queue
+import re
+import threading
+import time
+import weakref
+from urllib.parse import urlsplit, urlunsplit
 
 from aiogram import Bot, Dispatcher, types
-from aiogram.filters import CommandStart, Command
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.methods import GetUpdates
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiogram.filters import CommandStart, Command, CommandObject
 import aiohttp
-import json
+import orjson
+from aiohttp import web
 from aiogram import F
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, WebAppInfo
 from aiogram.exceptions import TelegramBadRequest
 from dotenv import load_dotenv
 
+if __package__:
+    from ._common import TokenBucket, telegram_bucket
+else:
+    # Started as `python bot/bot.py`, bot/ itself is on sys.path
+    from _common import TokenBucket, telegram_bucket
+
 
 load_dotenv()
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
 APP_URL = os.getenv("APP_URL", "http://localhost:8000")
+# Parse APP_URL once: drop a trailing slash so f"{APP_URL}/..." never doubles it
+_app_url_parts = urlsplit(APP_URL)
+APP_URL = urlunsplit(_app_url_parts._replace(path=_app_url_parts.path.rstrip('/')))
+IS_HTTPS = _app_url_parts.scheme == "https"
+# Webhook mode is used when WEBHOOK_BASE_URL is set, long polling otherwise
+WEBHOOK_BASE_URL = (os.getenv("WEBHOOK_BASE_URL") or "").rstrip('/')
+WEBHOOK_PATH = "/tg"
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8081"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+LOGS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'logs')
+
+# Shared HTTP session for calls to the web app API, see get_session()
+_session: aiohttp.ClientSession | None = None
+_session_lock = asyncio.Lock()
+# When the web app runs in the same container, reach it over its unix socket (see main.py)
+APP_SOCKET = os.getenv("APP_SOCKET")
+API_URL = "http://localhost" if APP_SOCKET else APP_URL
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "1024"))
+HTTP_POOL_PER_HOST = int(os.getenv("HTTP_POOL_PER_HOST", "512"))
+# When the web app lives in this process (main.py sets BOT_INPROC_API), call its
+# functions directly instead of going through HTTP + JSON. main.py serves this
+# same webapp.app instance, so no second Flask app is created.
+USE_INPROC = os.getenv("BOT_INPROC_API", "").lower() == "true"
+if USE_INPROC:
+    try:
+        from webapp import app as webapp
+    except ImportError:
+        # Started as `python bot/bot.py`, the web app package is not importable
+        USE_INPROC = False
+# Admission control: callers beyond this queue on the semaphore, not on the pool
+MAX_INFLIGHT_API = int(os.getenv("MAX_INFLIGHT_API", "256"))
+API_SEM = asyncio.Semaphore(MAX_INFLIGHT_API)
+# Fail fast when the pool is saturated or the web app is slow to accept
+HTTP_TIMEOUT = aiohttp.ClientTimeout(total=5, connect=1, sock_connect=1, sock_read=3)
+
+log = logging.getLogger("bot")
+
+BULK_URL = f"{API_URL}/api/cards/bulk"
+# Service calls that carry several users' data (bulk reviews) authenticate with this key;
+# keep the derivation in sync with service_key() in webapp/app.py
+API_SERVICE_KEY = hmac.new(BOT_TOKEN.encode(), b"api-service", hashlib.sha256).hexdigest() if BOT_TOKEN else ""
+LOAD_WORDS_SUCCESS_TMPL = (
+    "✅ Успешно загружено!\n\n"
+    "📥 Создано новых карточек: {created}\n"
+    "📊 Всего обработано: {total}\n"
+    "⏭️ Пропущено дубликатов: {skipped}\n\n"
+    "Теперь можете изучать новые слова! 🚀"
+)
+LOAD_WORDS_API_ERROR_TMPL = "❌ Ошибка API: {error}"
+LOAD_WORDS_HTTP_ERROR_TMPL = "❌ Ошибка сервера: HTTP {status}"
+
+# APP_URL is fixed after load_dotenv(), so static replies and keyboards are built once
+STUDY_URL = f"{APP_URL}/study.html"
+START_TEXT = "Нажми кнопку, чтобы открыть мини‑приложение со счётчиком."
+FALLBACK_TEXT = "Нажми кнопку, чтобы получить ссылку на мини‑приложение."
+LINK_TEXT = (
+    f"🚀 Мини‑приложение:\n{APP_URL or 'http://localhost:8000'}\n\n"
+    "💡 Нажми на ссылку выше, чтобы открыть приложение в браузере."
+)
+START_KB = InlineKeyboardMarkup(inline_keyboard=[[
+    InlineKeyboardButton(text="🚀 Открыть мини‑приложение", web_app=WebAppInfo(url=APP_URL))
+]]) if IS_HTTPS else None
+GET_LINK_KB = InlineKeyboardMarkup(inline_keyboard=[[
+    InlineKeyboardButton(text="🚀 Получить ссылку", callback_data="get_link")
+]])
+OPEN_ALL_CARDS_ROW = [InlineKeyboardButton(text="📚 Открыть все карточки", url=STUDY_URL)]
+ALL_CARDS_ROW = [InlineKeyboardButton(text="📚 Все карточки", url=STUDY_URL)]
+STUDY_MORE_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="📚 Изучать дальше", url=STUDY_URL)]
+])
+
+
+def _btn(**kwargs) -> InlineKeyboardButton:
+    # Per-card buttons are built from trusted literals, skip pydantic validation
+    return InlineKeyboardButton.model_construct(**kwargs)
+
+
+def study_kb(card_id: str) -> InlineKeyboardMarkup:
+    """Keyboard under a card's front side"""
+    return InlineKeyboardMarkup.model_construct(inline_keyboard=[
+        [_btn(text="👁‍🗨 Показать ответ", callback_data=f"show_answer_{card_id}")],
+        OPEN_ALL_CARDS_ROW
+    ])
+
+
+def quality_kb(card_id: str) -> InlineKeyboardMarkup:
+    """Quality rating keyboard, only callback_data depends on the card"""
+    return InlineKeyboardMarkup.model_construct(inline_keyboard=[
+        [
+            _btn(text="😞 Плохо (1)", callback_data=f"quality_{card_id}_1"),
+            _btn(text="🤔 Слабо (2)", callback_data=f"quality_{card_id}_2")
+        ],
+        [
+            _btn(text="😐 Нормально (3)", callback_data=f"quality_{card_id}_3"),
+            _btn(text="😊 Хорошо (4)", callback_data=f"quality_{card_id}_4")
+        ],
+        [
+            _btn(text="🎯 Отлично (5)", callback_data=f"quality_{card_id}_5")
+        ],
+        ALL_CARDS_ROW
+    ])
+
+
+STUDY_TMPL = """📖 <b>Изучение карточки</b>
+
+<b>Слово:</b> <code>{front}</code>
+
+🤔 <i>Попробуйте вспомнить перевод, затем нажмите "Показать ответ"</i>"""
+ANSWER_TMPL = """📖 <b>Карточка с ответом</b>
+
+<b>Слово:</b> <code>{front}</code>
+<b>Перевод:</b> <i>{back}</i>
+
+❓ <b>Насколько хорошо вы помните эту карточку?</b>"""
+# Callback data prefixes handled by on_card_callback, and the valid quality ratings
+CARD_CALLBACK_PREFIXES = ("study_card_", "show_answer_", "quality_")
+QUALITY_ARGS = frozenset("12345")
+QUALITY_TEXTS = ("", "😞 Плохо", "🤔 Слабо", "😐 Нормально", "😊 Хорошо", "🎯 Отлично")
+# Only five possible ratings, so the final messages are rendered up front
+QUALITY_DONE_MESSAGES = tuple(f"""✅ <b>Карточка изучена!</b>
+
+<b>Ваша оценка:</b> {quality_text}
+
+🎉 <i>Отлично! Карточка добавлена в систему интервального повторения. Увидимся в следующий раз!</i>
+
+📚 Продолжайте изучение в приложении.""" for quality_text in QUALITY_TEXTS)
+NOTIFICATIONS_TMPL = (
+    "🔔 <b>Настройки уведомлений</b>\n\n"
+    "Статус: {status}\n"
+    "Время: {time}\n\n"
+    "Команды:\n"
+    "📅 <code>/set_time HH:MM</code> - изменить время\n"
+    "🔕 <code>/notifications_off</code> - отключить\n"
+    "🔔 <code>/notifications_on</code> - включить"
+)
+
+# Bulk loads are slow; bound them and allow only one in flight per user
+LOAD_WORDS_TIMEOUT = aiohttp.ClientTimeout(total=30, connect=5)
+_load_words_locks: "weakref.WeakValueDictionary[int, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+# Study -> show answer fetches the same card twice within seconds
+CARD_CACHE_TTL = 120
+CARD_CACHE_MAXSIZE = 4096
+_card_cache: dict[tuple[int, str], tuple[float, dict]] = {}
+_card_inflight: dict[tuple[int, str], asyncio.Task] = {}
+# Last HTML body sent per (chat_id, message_id), to skip re-sending unchanged text
+SENT_TEXTS_MAXSIZE = 4096
+_sent_texts: dict[tuple[int, int], str] = {}
+# Strong references to fire-and-forget handler tasks until they finish
+_background_tasks: set[asyncio.Task] = set()
+
+# /notifications reads settings from here; successful updates write through
+SETTINGS_CACHE_TTL = 300
+_settings_cache: dict[int, tuple[float, dict]] = {}
+
+# HH:MM, 00:00-23:59
+TIME_RE = re.compile(r'([01]\d|2[0-3]):[0-5]\d')
+
+# Settings writes are debounced per user, see update_settings()
+SETTINGS_DEBOUNCE = 0.2
+_pending_settings: dict[int, tuple[dict, asyncio.TimerHandle, asyncio.Future]] = {}
+
+# Ratings are queued and sent to the web app in batches by _review_flusher()
+REVIEW_BATCH_WINDOW = 0.05
+REVIEW_BATCH_MAX = 64
+# On shutdown the batch being sent gets this long to finish before its ratings are failed
+REVIEW_SHUTDOWN_TIMEOUT = 5
+# Longest a rating waits for its batch before the card shows the save error
+QUALITY_SAVE_TIMEOUT = 10
+_review_queue: asyncio.Queue = asyncio.Queue()
+# Set by close_review_flusher(), so ratings arriving during shutdown fail instead of waiting
+_reviews_closed = False
+
+
+async def get_session() -> aiohttp.ClientSession:
+    """Shared web app API session, (re)created on first use after startup or a restart"""
+    global _session
+    async with _session_lock:
+        if _session is None or _session.closed:
+            _session = aiohttp.ClientSession(
+                connector=create_api_connector(),
+                timeout=HTTP_TIMEOUT,
+                json_serialize=lambda obj: orjson.dumps(obj).decode(),
+            )
+        return _session
+
+
+async def close_session():
+    global _session
+    async with _session_lock:
+        if _session is not None:
+            await _session.close()
+            _session = None
 
 
 async def get_card_for_study(user_id: int, card_id: str) -> dict:
     """Get card details for study via API"""
+    key = (user_id, card_id)
+    cached = _card_cache.get(key)
+    if cached is not None and cached[0] > time.monotonic():
+        return cached[1]
+
+    # Concurrent misses for the same card share one request
+    task = _card_inflight.get(key)
+    if task is None:
+        task = _card_inflight[key] = asyncio.create_task(_fetch_card(user_id, card_id))
+        task.add_done_callback(lambda _: _card_inflight.pop(key, None))
+    return await asyncio.shield(task)
+
+
+async def _fetch_card(user_id: int, card_id: str) -> dict:
+    key = (user_id, card_id)
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                f"{APP_URL}/api/cards/{card_id}",
-                json={"user_id": user_id},
-                headers={"Content-Type": "application/json"}
-            ) as resp:
+        card = None
+        if USE_INPROC:
+            if card_id.isdecimal():
+                card = await asyncio.to_thread(webapp.get_card_by_id, user_id, int(card_id))
+        else:
+            session = await get_session()
+            async with API_SEM, session.get(f"{API_URL}/api/cards/{card_id}", json={"user_id": user_id}) as resp:
                 if resp.status == 200:
-                    result = await resp.json()
+                    result = orjson.loads(await resp.read())
                     if result.get("ok"):
-                        return result.get("card")
-                return None
+                        card = result.get("card")
+        if card is not None:
+            if len(_card_cache) >= CARD_CACHE_MAXSIZE:
+                # Dicts keep insertion order, so this drops the oldest entry
+                del _card_cache[next(iter(_card_cache))]
+            _card_cache[key] = (time.monotonic() + CARD_CACHE_TTL, card)
+        return card
+    except asyncio.TimeoutError:
+        log.warning("Timed out getting card %s for user %s", card_id, user_id)
+        return None
     except Exception as e:
-        logging.error(f"Error getting card {card_id} for user {user_id}: {e}")
+        log.error("Error getting card %s for user %s: %s", card_id, user_id, e)
         return None
 
 
+async def fetch_settings(user_id: int) -> tuple[int, dict]:
+    """GET /api/settings, returns (HTTP status, response body)"""
+    if USE_INPROC:
+        return 200, {"ok": True, "settings": await asyncio.to_thread(webapp.get_user_settings, user_id)}
+    session = await get_session()
+    async with API_SEM, session.get(
+        f"{API_URL}/api/settings",
+        headers={"X-Service-Key": API_SERVICE_KEY},
+        params={"user_id": user_id}
+    ) as resp:
+        return resp.status, orjson.loads(await resp.read()) if resp.status == 200 else {}
+
+
+async def update_settings(payload: dict) -> tuple[int, dict]:
+    """POST /api/settings, coalescing a user's updates that arrive within SETTINGS_DEBOUNCE"""
+    user_id = payload["user_id"]
+    loop = asyncio.get_running_loop()
+    pending = _pending_settings.get(user_id)
+    if pending is None:
+        merged, fut = dict(payload), loop.create_future()
+    else:
+        merged, timer, fut = pending
+        timer.cancel()
+        merged.update(payload)
+    timer = loop.call_later(SETTINGS_DEBOUNCE, _flush_settings, user_id)
+    _pending_settings[user_id] = (merged, timer, fut)
+    # Every handler in the burst gets the result of the one combined write
+    return await asyncio.shield(fut)
+
+
+def _flush_settings(user_id: int):
+    merged, _, fut = _pending_settings.pop(user_id)
+    task = asyncio.create_task(_post_settings(merged))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+    def _resolve(t: asyncio.Task):
+        if t.cancelled():
+            fut.cancel()
+        elif t.exception() is not None:
+            fut.set_exception(t.exception())
+        else:
+            status, result = t.result()
+            if status == 200 and result.get("ok"):
+                cache_settings(user_id, merged)
+            fut.set_result((status, result))
+    task.add_done_callback(_resolve)
+
+
+async def _post_settings(payload: dict) -> tuple[int, dict]:
+    """POST /api/settings, returns (HTTP status, response body)"""
+    if USE_INPROC:
+        fields = {k: v for k, v in payload.items() if k != "user_id"}
+        try:
+            await asyncio.to_thread(webapp.update_user_settings, payload["user_id"], **fields)
+        except ValueError:
+            return 400, {"ok": False, "error": "Invalid time format. Use HH:MM"}
+        return 200, {"ok": True}
+    session = await get_session()
+    async with API_SEM, session.post(f"{API_URL}/api/settings", json=payload) as resp:
+        return resp.status, orjson.loads(await resp.read()) if resp.status == 200 else {}
+
+
+async def bulk_create_cards(user_id: int) -> tuple[int, dict]:
+    """POST /api/cards/bulk, returns (HTTP status, response body)"""
+    if USE_INPROC:
+        result, status = await asyncio.to_thread(webapp.import_new_words, user_id)
+        return status, result
+    session = await get_session()
+    async with API_SEM, session.post(
+        BULK_URL,
+        json={"user_id": user_id},
+        timeout=LOAD_WORDS_TIMEOUT
+    ) as resp:
+        return resp.status, orjson.loads(await resp.read()) if resp.status == 200 else {}
+
+
+def get_cached_settings(user_id: int) -> dict | None:
+    cached = _settings_cache.get(user_id)
+    if cached is not None and cached[0] > time.monotonic():
+        return cached[1]
+    return None
+
+
+def cache_settings(user_id: int, settings: dict) -> None:
+    """Remember settings as stored by the API (POST /api/settings fills omitted fields with defaults)"""
+    _settings_cache[user_id] = (time.monotonic() + SETTINGS_CACHE_TTL, {
+        "notifications_enabled": settings.get("notifications_enabled", True),
+        "study_reminder_time": settings.get("study_reminder_time", "09:00"),
+        "timezone": settings.get("timezone", "UTC"),
+    })
+
+
+async def edit_card_message(message: types.Message, text: str, reply_markup: InlineKeyboardMarkup):
+    """edit_text, or only edit_reply_markup when the body is already what we sent"""
+    key = (message.chat.id, message.message_id)
+    if _sent_texts.get(key) == text:
+        try:
+            await message.edit_reply_markup(reply_markup=reply_markup)
+        except TelegramBadRequest as e:
+            if "message is not modified" not in str(e):
+                raise
+        return
+
+    await message.edit_text(text, parse_mode="HTML", reply_markup=reply_markup)
+    if len(_sent_texts) >= SENT_TEXTS_MAXSIZE:
+        del _sent_texts[next(iter(_sent_texts))]
+    _sent_texts[key] = text
+
+
 async def submit_card_quality(user_id: int, card_id: str, quality: int) -> bool:
-    """Submit card quality rating via API"""
+    """Submit card quality rating via API (batched with concurrent ratings)"""
+    if _reviews_closed:
+        return False
+    fut = asyncio.get_running_loop().create_future()
+    await _review_queue.put((user_id, card_id, quality, fut))
+    ok = await fut
+    if ok:
+        # The review changed the card's schedule, refetch next time
+        _card_cache.pop((user_id, card_id), None)
+    return ok
+
+
+def start_review_flusher() -> asyncio.Task:
+    """(Re)open the review queue and start the task that sends it"""
+    global _reviews_closed
+    _reviews_closed = False
+    return asyncio.create_task(_review_flusher())
+
+
+async def close_review_flusher(flusher: asyncio.Task) -> None:
+    """Let the flusher send what is already queued, then fail any rating still waiting"""
+    global _reviews_closed
+    _reviews_closed = True
+    # None tells the flusher to stop after the current batch
+    _review_queue.put_nowait(None)
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                f"{APP_URL}/api/cards/{card_id}/review",
-                json={"user_id": user_id, "quality": quality},
-                headers={"Content-Type": "application/json"}
+        await asyncio.wait_for(flusher, REVIEW_SHUTDOWN_TIMEOUT)
+    except asyncio.TimeoutError:
+        log.warning("Review flusher did not finish within %ss, failing pending ratings", REVIEW_SHUTDOWN_TIMEOUT)
+    except Exception as e:
+        log.error("Review flusher error: %s", e)
+    while not _review_queue.empty():
+        item = _review_queue.get_nowait()
+        if item is not None and not item[3].done():
+            item[3].set_result(False)
+
+
+async def _review_flusher():
+    """Drain queued ratings into one /api/cards/review/bulk call per window, until None is queued"""
+    loop = asyncio.get_running_loop()
+    closing = False
+    while not closing:
+        item = await _review_queue.get()
+        if item is None:
+            return
+        batch = [item]
+        deadline = loop.time() + REVIEW_BATCH_WINDOW
+        while len(batch) < REVIEW_BATCH_MAX:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(_review_queue.get(), remaining)
+            except asyncio.TimeoutError:
+                break
+            if item is None:
+                closing = True
+                break
+            batch.append(item)
+        await _flush_reviews(batch)
+
+
+async def _flush_reviews(batch: list) -> None:
+    results = [False] * len(batch)
+    reviews = [
+        {"user_id": user_id, "card_id": card_id, "quality": quality}
+        for user_id, card_id, quality, _ in batch
+    ]
+    try:
+        if USE_INPROC:
+            results = await asyncio.to_thread(webapp.review_cards_bulk, reviews)
+        else:
+            session = await get_session()
+            async with API_SEM, session.post(
+                f"{API_URL}/api/cards/review/bulk",
+                headers={"X-Service-Key": API_SERVICE_KEY},
+                json={"reviews": reviews}
             ) as resp:
                 if resp.status == 200:
-                    result = await resp.json()
-                    return result.get("ok", False)
-                return False
+                    result = orjson.loads(await resp.read())
+                    if result.get("ok"):
+                        results = result.get("results", results)
+                else:
+                    log.error("Error submitting %s reviews: HTTP %s", len(batch), resp.status)
+    except asyncio.TimeoutError:
+        log.warning("Timed out submitting %s reviews", len(batch))
     except Exception as e:
-        logging.error(f"Error submitting quality for card {card_id}: {e}")
-        return False
+        log.error("Error submitting %s reviews: %s", len(batch), e)
+    finally:
+        # Also runs when the flusher is cancelled mid-request, so no caller waits forever
+        for i, (_, _, _, fut) in enumerate(batch):
+            if not fut.done():
+                fut.set_result(i < len(results) and bool(results[i]))
 
 
-async def main():
-    # Configure logging to console + file
-    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+class TelegramRateLimiter(BaseRequestMiddleware):
+    """Paces outgoing Bot API calls through a token bucket (shared with the scheduler by default)"""
+
+    def __init__(self, bucket: TokenBucket = telegram_bucket):
+        self._bucket = bucket
+
+    async def __call__(self, make_request, bot, method):
+        # Long polling is not an outgoing message, never hold it back
+        if not isinstance(method, GetUpdates):
+            await self._bucket.acquire()
+        return await make_request(bot, method)
+
+
+async def run_webhook(bot: Bot, dp: Dispatcher, allowed_updates: list[str]):
+    """Receive updates pushed by Telegram instead of long polling"""
+    app = web.Application()
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, "0.0.0.0", WEBHOOK_PORT).start()
+        await bot.set_webhook(
+            f"{WEBHOOK_BASE_URL}{WEBHOOK_PATH}",
+            allowed_updates=allowed_updates,
+            secret_token=WEBHOOK_SECRET,
+        )
+        log.info("Webhook set to %s%s, listening on port %s", WEBHOOK_BASE_URL, WEBHOOK_PATH, WEBHOOK_PORT)
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+def create_api_connector() -> aiohttp.BaseConnector:
+    """Connector for web app API calls: unix socket when co-located, TCP otherwise"""
+    if APP_SOCKET:
+        return aiohttp.UnixConnector(
+            path=APP_SOCKET,
+            limit=HTTP_POOL_SIZE,
+            limit_per_host=HTTP_POOL_PER_HOST,
+            keepalive_timeout=75,
+        )
+    return aiohttp.TCPConnector(
+        limit=HTTP_POOL_SIZE,
+        limit_per_host=HTTP_POOL_PER_HOST,
+        ttl_dns_cache=600,
+        keepalive_timeout=75,
+        enable_cleanup_closed=True,
+    )
+
+
+def create_bot_session() -> AiohttpSession:
+    """Bot API session with a 256-connection keep-alive pool, sized for callback bursts
+
+    All requests go to api.telegram.org, so the pool limit is effectively the per-host limit.
+    """
+    session = AiohttpSession(limit=256, timeout=20)
+    session.middleware(TelegramRateLimiter())
+    return session
+
+
+class TimedMemoryHandler(MemoryHandler):
+    """MemoryHandler that also writes buffered records out every flush_interval seconds"""
+
+    def __init__(self, capacity: int, flush_interval: float = 30.0, **kwargs):
+        super().__init__(capacity, **kwargs)
+        # Quiet periods would otherwise leave INFO records in memory indefinitely
+        self._stopped = threading.Event()
+        threading.Thread(target=self._flush_periodically, args=(flush_interval,), daemon=True).start()
+
+    def _flush_periodically(self, interval: float):
+        while not self._stopped.wait(interval):
+            self.flush()
+
+    def close(self):
+        self._stopped.set()
+        super().close()
+
+
+def setup_logging() -> tuple[QueueHandler, QueueListener]:
+    """Route root logging through a queue so handlers never write to disk on the event loop"""
+    formatter = logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s')
+    root = logging.getLogger()
+    handlers = []
+    if not root.handlers:
+        sh = logging.StreamHandler()
+        sh.setFormatter(formatter)
+        handlers.append(sh)
+    fh = None
     try:
-        logs_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'logs')
-        os.makedirs(logs_dir, exist_ok=True)
-        fh = RotatingFileHandler(os.path.join(logs_dir, 'bot.log'), maxBytes=2_000_000, backupCount=2, encoding='utf-8')
+        os.makedirs(LOGS_DIR, exist_ok=True)
+        fh = RotatingFileHandler(os.path.join(LOGS_DIR, 'bot.log'), maxBytes=2_000_000, backupCount=2, encoding='utf-8', delay=True)
         fh.setLevel(logging.INFO)
-        fh.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
-        logging.getLogger().addHandler(fh)
-        logging.info('Bot file logging configured: %s', fh.baseFilename)
+        fh.setFormatter(formatter)
+        # Coalesce INFO records into batched writes at most 30s apart; WARNING+ flushes immediately
+        mh = TimedMemoryHandler(256, flush_interval=30, flushLevel=logging.WARNING, target=fh, flushOnClose=True)
+        handlers.append(mh)
     except Exception:
         pass
 
+    log_queue = queue.SimpleQueue()
+    queue_handler = QueueHandler(log_queue)
+    root.addHandler(queue_handler)
+    root.setLevel(LOG_LEVEL)
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    if fh is not None:
+        log.info('Bot file logging configured: %s', fh.baseFilename)
+    return queue_handler, listener
+
+
+def teardown_logging(queue_handler: QueueHandler, listener: QueueListener) -> None:
+    """Undo setup_logging(), main() runs again after a crash and sets it up anew"""
+    logging.getLogger().removeHandler(queue_handler)
+    listener.stop()
+    for handler in listener.handlers:
+        # Stops the TimedMemoryHandler's flush thread; its RotatingFileHandler target is closed too
+        target = getattr(handler, "target", None)
+        handler.close()
+        if target is not None:
+            target.close()
+
+
+async def main():
+    # Configure logging to console + file
+    log_handler, log_listener = setup_logging()
+    # Per-update "is handled" INFO records are mostly liveness /health probes
+    logging.getLogger('aiogram.event').setLevel(logging.WARNING)
+
     if not BOT_TOKEN:
         raise RuntimeError("BOT_TOKEN is not set in environment")
 
-    bot = Bot(BOT_TOKEN)
+    bot = Bot(BOT_TOKEN, session=create_bot_session())
     dp = Dispatcher()
 
-    logging.info("APP_URL=%s (https=%s)", APP_URL, str(APP_URL).startswith("https://"))
+    log.info("APP_URL=%s https=%s", APP_URL, IS_HTTPS)
+
+    @dp.errors()
+    async def on_error(event: types.ErrorEvent):
+        log.error("handler failed: %s", event.exception, exc_info=event.exception)
+        return True
 
     @dp.message(CommandStart())
     async def on_start(message: types.Message):
-        try:
-            logging.info("/start from id=%s username=%s", message.from_user.id, message.from_user.username)
-            text = "Нажми кнопку, чтобы открыть мини‑приложение со счётчиком."
-            
-            if APP_URL and APP_URL.startswith("https://"):
-                # Use inline keyboard with WebApp button
-                kb = InlineKeyboardMarkup(inline_keyboard=[[
-                    InlineKeyboardButton(text="🚀 Открыть мини‑приложение", web_app=WebAppInfo(url=APP_URL))
-                ]])
-                try:
-                    await message.answer(text, reply_markup=kb)
-                    return
-                except TelegramBadRequest as e:
-                    logging.warning("inline web_app button failed: %s", e)
+        if log.isEnabledFor(logging.INFO):
+            log.info("/start from id=%s username=%s", message.from_user.id, message.from_user.username)
+        
+        if IS_HTTPS:
+            # Use inline keyboard with WebApp button
+            try:
+                await message.answer(START_TEXT, reply_markup=START_KB)
+                return
+            except TelegramBadRequest as e:
+                log.warning("inline web_app button failed: %s", e)
 
-            # Fallback for non-HTTPS APP_URL: use callback button
-            kb = InlineKeyboardMarkup(inline_keyboard=[[
-                InlineKeyboardButton(text="🚀 Получить ссылку", callback_data="get_link")
-            ]])
-            await message.answer(
-                "Нажми кнопку, чтобы получить ссылку на мини‑приложение.",
-                reply_markup=kb
-            )
-        except Exception as e:
-            logging.exception("/start handler failed: %s", e)
+        # Fallback for non-HTTPS APP_URL: use callback button
+        await message.answer(FALLBACK_TEXT, reply_markup=GET_LINK_KB)
 
     @dp.callback_query(F.data == "get_link")
     async def on_get_link(callback: types.CallbackQuery):
-        try:
-            await callback.answer()
-            await callback.message.answer(
-                f"🚀 Мини‑приложение:\n{APP_URL or 'http://localhost:8000'}\n\n"
-                "💡 Нажми на ссылку выше, чтобы открыть приложение в браузере."
-            )
-            logging.info("Link sent to user id=%s", callback.from_user.id)
-        except Exception as e:
-            logging.exception("get_link callback failed: %s", e)
+        # Both Bot API calls are independent, send them concurrently
+        await asyncio.gather(callback.answer(), callback.message.answer(LINK_TEXT))
+        if log.isEnabledFor(logging.INFO):
+            log.info("Link sent to user id=%s", callback.from_user.id)
 
     @dp.message(Command("health"))
     async def on_health(message: types.Message):
-        await message.answer("ok: polling active")
+        await message.answer("ok: webhook active" if WEBHOOK_BASE_URL else "ok: polling active")
 
     @dp.message(Command("load_words"))
     async def on_load_words(message: types.Message):
         """Load words from new_words.json file via API"""
+        loading_msg = None
         try:
             user_id = message.from_user.id
-            logging.info("LOAD_WORDS command from user_id=%s", user_id)
+            log.info("LOAD_WORDS command from user_id=%s", user_id)
             
-            # Send loading message
-            loading_msg = await message.answer("⏳ Загружаю слова из файла...")
-            
-            # Prepare API request data
-            api_data = {
-                "user_id": user_id
-            }
+            lock = _load_words_locks.get(user_id)
+            if lock is None:
+                lock = _load_words_locks[user_id] = asyncio.Lock()
+            if lock.locked():
+                await message.answer("⏳ Загрузка уже выполняется, подождите...")
+                return
             
-            # Make request to bulk create API
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    f"{APP_URL}/api/cards/bulk",
-                    json=api_data,
-                    headers={"Content-Type": "application/json"}
-                ) as resp:
-                    if resp.status == 200:
-                        result = await resp.json()
-                        if result.get("ok"):
-                            created = result.get("created", 0)
-                            total = result.get("total_processed", 0)
-                            skipped = result.get("skipped", 0)
-                            
-                            await loading_msg.edit_text(
-                                f"✅ Успешно загружено!\n\n"
-                                f"📥 Создано новых карточек: {created}\n"
-                                f"📊 Всего обработано: {total}\n"
-                                f"⏭️ Пропущено дубликатов: {skipped}\n\n"
-                                f"Теперь можете изучать новые слова! 🚀"
-                            )
-                        else:
-                            error = result.get("error", "неизвестная ошибка")
-                            await loading_msg.edit_text(f"❌ Ошибка API: {error}")
+            async with lock:
+                # Send loading message
+                loading_msg = await message.answer("⏳ Загружаю слова из файла...")
+                
+                # Make request to bulk create API
+                status, result = await bulk_create_cards(user_id)
+                if status == 200:
+                    if result.get("ok"):
+                        await loading_msg.edit_text(LOAD_WORDS_SUCCESS_TMPL.format(
+                            created=result.get("created", 0),
+                            total=result.get("total_processed", 0),
+                            skipped=result.get("skipped", 0),
+                        ))
                     else:
-                        await loading_msg.edit_text(f"❌ Ошибка сервера: HTTP {resp.status}")
+                        error = result.get("error", "неизвестная ошибка")
+                        await loading_msg.edit_text(LOAD_WORDS_API_ERROR_TMPL.format(error=error))
+                else:
+                    await loading_msg.edit_text(LOAD_WORDS_HTTP_ERROR_TMPL.format(status=status))
                         
-        except aiohttp.ClientError as e:
-            logging.error("LOAD_WORDS network error: %s", e)
-            await message.answer("❌ Ошибка сети. Проверьте подключение к серверу.")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            log.error("LOAD_WORDS network error: %r", e)
+            await _reply_or_edit(message, loading_msg, "❌ Ошибка сети. Проверьте подключение к серверу.")
         except Exception as e:
-            logging.exception("LOAD_WORDS error: %s", e)
-            await message.answer("❌ Произошла ошибка при загрузке слов.")
+            log.exception("LOAD_WORDS error: %s", e)
+            await _reply_or_edit(message, loading_msg, "❌ Произошла ошибка при загрузке слов.")
+
+    async def _reply_or_edit(message: types.Message, loading_msg: types.Message | None, text: str):
+        """Replace the loading message in place, or reply if it was never sent"""
+        if loading_msg is not None:
+            await loading_msg.edit_text(text)
+        else:
+            await message.answer(text)
 
     @dp.message(Command("notifications"))
     async def on_notifications(message: types.Message):
@@ -179,47 +706,39 @@ async def main():
             user_id = message.from_user.id
             
             # Get current settings
-            async with aiohttp.ClientSession() as session:
-                async with session.get(
-                    f"{APP_URL}/api/settings",
-                    json={"user_id": user_id},
-                    headers={"Content-Type": "application/json"}
-                ) as resp:
-                    if resp.status == 200:
-                        result = await resp.json()
-                        if result.get("ok"):
-                            settings = result["settings"]
-                            enabled = settings["notifications_enabled"]
-                            time_str = settings["study_reminder_time"]
-                            
-                            status = "✅ Включены" if enabled else "❌ Отключены"
-                            
-                            await message.answer(
-                                f"🔔 <b>Настройки уведомлений</b>\n\n"
-                                f"Статус: {status}\n"
-                                f"Время: {time_str}\n\n"
-                                f"Команды:\n"
-                                f"📅 <code>/set_time HH:MM</code> - изменить время\n"
-                                f"🔕 <code>/notifications_off</code> - отключить\n"
-                                f"🔔 <code>/notifications_on</code> - включить",
-                                parse_mode="HTML"
-                            )
-                        else:
-                            await message.answer("❌ Ошибка получения настроек")
-                    else:
-                        await message.answer("❌ Ошибка сервера")
-                        
+            settings = get_cached_settings(user_id)
+            if settings is None:
+                status, result = await fetch_settings(user_id)
+                if status != 200:
+                    await message.answer("❌ Ошибка сервера")
+                    return
+                if not result.get("ok"):
+                    await message.answer("❌ Ошибка получения настроек")
+                    return
+                settings = result["settings"]
+                cache_settings(user_id, settings)
+            
+            status = "✅ Включены" if settings["notifications_enabled"] else "❌ Отключены"
+            
+            await message.answer(
+                NOTIFICATIONS_TMPL.format(status=status, time=settings["study_reminder_time"]),
+                parse_mode="HTML"
+            )
+                    
+        except asyncio.TimeoutError:
+            log.warning("NOTIFICATIONS timed out")
+            await message.answer("❌ Сервер не отвечает, попробуйте позже")
         except Exception as e:
-            logging.exception("NOTIFICATIONS error: %s", e)
+            log.exception("NOTIFICATIONS error: %s", e)
             await message.answer("❌ Произошла ошибка")
 
     @dp.message(Command("set_time"))
-    async def on_set_time(message: types.Message):
+    async def on_set_time(message: types.Message, command: CommandObject):
         """Set notification time"""
         try:
-            # Parse time from command
-            args = message.text.split()
-            if len(args) < 2:
+            # Arguments were already split off by the Command filter, only the first matters
+            time_str, _, _ = (command.args or "").strip().partition(' ')
+            if not time_str:
                 await message.answer(
                     "⏰ Укажите время в формате HH:MM\n"
                     "Пример: <code>/set_time 09:30</code>",
@@ -227,39 +746,33 @@ async def main():
                 )
                 return
             
-            time_str = args[1]
-            
             # Validate time format
-            try:
-                datetime.strptime(time_str, '%H:%M')
-            except ValueError:
+            if not TIME_RE.fullmatch(time_str):
                 await message.answer("❌ Неверный формат времени. Используйте HH:MM (например: 09:30)")
                 return
             
             user_id = message.from_user.id
             
             # Update settings
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    f"{APP_URL}/api/settings",
-                    json={
-                        "user_id": user_id,
-                        "study_reminder_time": time_str,
-                        "notifications_enabled": True
-                    },
-                    headers={"Content-Type": "application/json"}
-                ) as resp:
-                    if resp.status == 200:
-                        result = await resp.json()
-                        if result.get("ok"):
-                            await message.answer(f"✅ Время напоминаний установлено на {time_str}")
-                        else:
-                            await message.answer("❌ Ошибка обновления настроек")
-                    else:
-                        await message.answer("❌ Ошибка сервера")
-                        
+            payload = {
+                "user_id": user_id,
+                "study_reminder_time": time_str,
+                "notifications_enabled": True
+            }
+            status, result = await update_settings(payload)
+            if status == 200:
+                if result.get("ok"):
+                    await message.answer(f"✅ Время напоминаний установлено на {time_str}")
+                else:
+                    await message.answer("❌ Ошибка обновления настроек")
+            else:
+                await message.answer("❌ Ошибка сервера")
+                    
+        except asyncio.TimeoutError:
+            log.warning("SET_TIME timed out")
+            await message.answer("❌ Сервер не отвечает, попробуйте позже")
         except Exception as e:
-            logging.exception("SET_TIME error: %s", e)
+            log.exception("SET_TIME error: %s", e)
             await message.answer("❌ Произошла ошибка")
 
     @dp.message(Command("notifications_on"))
@@ -277,41 +790,51 @@ async def main():
         try:
             user_id = message.from_user.id
             
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    f"{APP_URL}/api/settings",
-                    json={
-                        "user_id": user_id,
-                        "notifications_enabled": enabled
-                    },
-                    headers={"Content-Type": "application/json"}
-                ) as resp:
-                    if resp.status == 200:
-                        result = await resp.json()
-                        if result.get("ok"):
-                            status = "включены" if enabled else "отключены"
-                            emoji = "🔔" if enabled else "🔕"
-                            await message.answer(f"{emoji} Уведомления {status}")
-                        else:
-                            await message.answer("❌ Ошибка обновления настроек")
-                    else:
-                        await message.answer("❌ Ошибка сервера")
-                        
+            payload = {
+                "user_id": user_id,
+                "notifications_enabled": enabled
+            }
+            status, result = await update_settings(payload)
+            if status == 200:
+                if result.get("ok"):
+                    status = "включены" if enabled else "отключены"
+                    emoji = "🔔" if enabled else "🔕"
+                    await message.answer(f"{emoji} Уведомления {status}")
+                else:
+                    await message.answer("❌ Ошибка обновления настроек")
+            else:
+                await message.answer("❌ Ошибка сервера")
+                    
+        except asyncio.TimeoutError:
+            log.warning("TOGGLE_NOTIFICATIONS timed out")
+            await message.answer("❌ Сервер не отвечает, попробуйте позже")
         except Exception as e:
-            logging.exception("TOGGLE_NOTIFICATIONS error: %s", e)
+            log.exception("TOGGLE_NOTIFICATIONS error: %s", e)
             await message.answer("❌ Произошла ошибка")
 
-    @dp.callback_query(F.data.startswith("study_card_"))
-    async def on_study_card(callback: types.CallbackQuery):
+    @dp.callback_query(F.data.startswith(CARD_CALLBACK_PREFIXES))
+    async def on_card_callback(callback: types.CallbackQuery):
+        """Dispatch study_card_<id>, show_answer_<id> and quality_<id>_<q> callbacks"""
+        action, _, arg = callback.data.rpartition("_")
+        match action:
+            case "study_card":
+                await on_study_card(callback, arg)
+            case "show_answer":
+                await on_show_answer(callback, arg)
+            case _ if action.startswith("quality_") and arg in QUALITY_ARGS:
+                await on_quality_rating(callback, action[len("quality_"):], int(arg))
+            case _:
+                # Malformed card callback (e.g. a quality outside 1-5): still stop the spinner
+                await callback.answer()
+
+    async def on_study_card(callback: types.CallbackQuery, card_id: str):
         """Handle study card button clicks"""
         try:
             await callback.answer()
             
-            # Extract card ID from callback data
-            card_id = callback.data.split("_")[-1]
             user_id = callback.from_user.id
             
-            logging.info("STUDY_CARD callback from user_id=%s card_id=%s", user_id, card_id)
+            log.info("STUDY_CARD callback from user_id=%s card_id=%s", user_id, card_id)
             
             # Get card details
             card_data = await get_card_for_study(user_id, card_id)
@@ -321,30 +844,17 @@ async def main():
                 return
             
             # Create study interface
-            study_message = f"""📖 <b>Изучение карточки</b>
-
-<b>Слово:</b> <code>{card_data['front']}</code>
-
-🤔 <i>Попробуйте вспомнить перевод, затем нажмите "Показать ответ"</i>"""
-            
-            keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="👁‍🗨 Показать ответ", callback_data=f"show_answer_{card_id}")],
-                [InlineKeyboardButton(text="📚 Открыть все карточки", url=f"{APP_URL}/study.html")]
-            ])
-            
-            await callback.message.edit_text(study_message, parse_mode="HTML", reply_markup=keyboard)
+            await edit_card_message(callback.message, STUDY_TMPL.format_map(card_data), study_kb(card_id))
             
         except Exception as e:
-            logging.exception("STUDY_CARD callback error: %s", e)
+            log.exception("STUDY_CARD callback error: %s", e)
             await callback.message.edit_text("❌ Произошла ошибка при загрузке карточки")
     
-    @dp.callback_query(F.data.startswith("show_answer_"))
-    async def on_show_answer(callback: types.CallbackQuery):
+    async def on_show_answer(callback: types.CallbackQuery, card_id: str):
         """Show answer and quality buttons"""
         try:
             await callback.answer()
             
-            card_id = callback.data.split("_")[-1]
             user_id = callback.from_user.id
             
             # Get card details
@@ -354,86 +864,84 @@ async def main():
                 await callback.message.edit_text("❌ Карточка не найдена")
                 return
             
-            answer_message = f"""📖 <b>Карточка с ответом</b>
-
-<b>Слово:</b> <code>{card_data['front']}</code>
-<b>Перевод:</b> <i>{card_data['back']}</i>
-
-❓ <b>Насколько хорошо вы помните эту карточку?</b>"""
-            
-            keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                [
-                    InlineKeyboardButton(text="😞 Плохо (1)", callback_data=f"quality_{card_id}_1"),
-                    InlineKeyboardButton(text="🤔 Слабо (2)", callback_data=f"quality_{card_id}_2")
-                ],
-                [
-                    InlineKeyboardButton(text="😐 Нормально (3)", callback_data=f"quality_{card_id}_3"),
-                    InlineKeyboardButton(text="😊 Хорошо (4)", callback_data=f"quality_{card_id}_4")
-                ],
-                [
-                    InlineKeyboardButton(text="🎯 Отлично (5)", callback_data=f"quality_{card_id}_5")
-                ],
-                [
-                    InlineKeyboardButton(text="📚 Все карточки", url=f"{APP_URL}/study.html")
-                ]
-            ])
-            
-            await callback.message.edit_text(answer_message, parse_mode="HTML", reply_markup=keyboard)
+            await edit_card_message(callback.message, ANSWER_TMPL.format_map(card_data), quality_kb(card_id))
             
         except Exception as e:
-            logging.exception("SHOW_ANSWER callback error: %s", e)
+            log.exception("SHOW_ANSWER callback error: %s", e)
             await callback.message.edit_text("❌ Произошла ошибка")
     
-    @dp.callback_query(F.data.startswith("quality_"))
-    async def on_quality_rating(callback: types.CallbackQuery):
+    async def on_quality_rating(callback: types.CallbackQuery, card_id: str, quality: int):
         """Handle quality rating submission"""
+        # ACK first so the button spinner stops, then save and edit in the background;
+        # success is only reported by the final card edit
+        await callback.answer("Сохраняю…")
+        task = asyncio.create_task(_finalize_quality(callback, card_id, quality))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+
+    async def _finalize_quality(callback: types.CallbackQuery, card_id: str, quality: int):
         try:
-            await callback.answer("✅ Оценка сохранена!")
-            
-            # Parse callback data
-            parts = callback.data.split("_")
-            card_id = parts[1]
-            quality = int(parts[2])
             user_id = callback.from_user.id
             
-            logging.info("QUALITY_RATING from user_id=%s card_id=%s quality=%s", user_id, card_id, quality)
+            log.info("QUALITY_RATING from user_id=%s card_id=%s quality=%s", user_id, card_id, quality)
             
             # Submit quality rating via API
-            success = await submit_card_quality(user_id, card_id, quality)
+            try:
+                success = await asyncio.wait_for(
+                    submit_card_quality(user_id, card_id, quality), QUALITY_SAVE_TIMEOUT
+                )
+            except asyncio.TimeoutError:
+                log.warning("QUALITY_RATING timed out user_id=%s card_id=%s", user_id, card_id)
+                success = False
             
             if success:
-                quality_text = ["", "😞 Плохо", "🤔 Слабо", "😐 Нормально", "😊 Хорошо", "🎯 Отлично"][quality]
-                
-                final_message = f"""✅ <b>Карточка изучена!</b>
-
-<b>Ваша оценка:</b> {quality_text}
-
-🎉 <i>Отлично! Карточка добавлена в систему интервального повторения. Увидимся в следующий раз!</i>
-
-📚 Продолжайте изучение в приложении."""
-                
-                keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                    [InlineKeyboardButton(text="📚 Изучать дальше", url=f"{APP_URL}/study.html")]
-                ])
-                
-                await callback.message.edit_text(final_message, parse_mode="HTML", reply_markup=keyboard)
+                await edit_card_message(callback.message, QUALITY_DONE_MESSAGES[quality], STUDY_MORE_KB)
             else:
                 await callback.message.edit_text("❌ Ошибка при сохранении оценки. Попробуйте позже.")
             
         except Exception as e:
-            logging.exception("QUALITY_RATING error: %s", e)
-            await callback.message.edit_text("❌ Произошла ошибка при сохранении оценки")
+            log.exception("QUALITY_RATING error: %s", e)
+            try:
+                await callback.message.edit_text("❌ Произошла ошибка при сохранении оценки")
+            except Exception:
+                pass
 
-    # Ensure polling works (remove webhook if previously set)
-    try:
-        await bot.delete_webhook(drop_pending_updates=True)
-        logging.info("Webhook deleted (drop_pending_updates=True)")
-    except Exception as e:
-        logging.warning("delete_webhook failed: %s", e)
+    @dp.callback_query()
+    async def on_unknown_callback(callback: types.CallbackQuery):
+        """Registered last: answer callbacks no other handler matched (e.g. buttons from old versions)"""
+        log.warning("Unhandled callback data=%r from user_id=%s", callback.data, callback.from_user.id)
+        await callback.answer()
+
+    review_flusher = start_review_flusher()
 
-    logging.info("Starting polling...")
-    await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+    allowed_updates = dp.resolve_used_update_types()
+    try:
+        if WEBHOOK_BASE_URL:
+            await run_webhook(bot, dp, allowed_updates)
+        else:
+            # Ensure polling works (remove webhook if previously set)
+            try:
+                info = await bot.get_webhook_info()
+                if info.url or info.pending_update_count:
+                    await bot.delete_webhook(drop_pending_updates=True)
+                    log.info("Webhook deleted (drop_pending_updates=True)")
+            except Exception as e:
+                log.warning("delete_webhook failed: %s", e)
+
+            log.info("Starting polling... allowed_updates=%s", allowed_updates)
+            await dp.start_polling(bot, allowed_updates=allowed_updates)
+    finally:
+        await close_review_flusher(review_flusher)
+        await close_session()
+        await bot.session.close()
+        teardown_logging(log_handler, log_listener)
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    try:
+        import uvloop
+    except ImportError:
+        asyncio.run(main())
+    else:
+        with asyncio.Runner(loop_factory=uvloop.new_event_loop) as runner:
+            runner.run(main())
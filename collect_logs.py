@@ -1,11 +1,11 @@
 import asyncio
-import json
 import os
 import sys
 import time
 from pathlib import Path
-from urllib import request as urlrequest
 
+import aiohttp
+import orjson
 from dotenv import load_dotenv
 
 
@@ -13,9 +13,17 @@ def tail_file(path: Path, lines: int = 200) -> str:
     try:
         if not path.exists():
             return f"<no file: {path}>"
-        with path.open('r', encoding='utf-8', errors='ignore') as f:
-            data = f.readlines()
-        chunk = ''.join(data[-lines:])
+        # Read backwards in 64KB blocks until we have enough lines, not the whole file
+        with path.open('rb') as f:
+            f.seek(0, os.SEEK_END)
+            pos = f.tell()
+            buf = b''
+            while pos > 0 and buf.count(b'\n') <= lines:
+                block = min(65536, pos)
+                pos -= block
+                f.seek(pos)
+                buf = f.read(block) + buf
+        chunk = ''.join(buf.decode('utf-8', errors='ignore').splitlines(keepends=True)[-lines:])
         return chunk if chunk.strip() else f"<empty: {path}>"
     except Exception as e:
         return f"<error reading {path}: {e}>"
@@ -46,33 +54,37 @@ async def check_bot():
         return {"ok": False, "error": repr(e)}
 
 
-def http_post_json(url: str, body: dict, timeout: float = 2.0):
-    data = json.dumps(body).encode('utf-8')
-    req = urlrequest.Request(url, data=data, headers={'Content-Type': 'application/json'})
-    with urlrequest.urlopen(req, timeout=timeout) as resp:
-        return resp.status, json.loads(resp.read().decode('utf-8'))
+async def http_post_json(session: aiohttp.ClientSession, url: str, body: dict):
+    # json= sets Content-Type: application/json itself
+    async with session.post(url, json=body) as resp:
+        return resp.status, orjson.loads(await resp.read())
 
 
-def check_flask(base: str = "http://127.0.0.1:8000"):
+async def check_flask(base: str = "http://127.0.0.1:8000", timeout: float = 2.0):
     out = {}
-    try:
-        code, js = http_post_json(base + "/api/count", {"user_id": 123})
-        out["count_before"] = {"status": code, "json": js}
-    except Exception as e:
-        out["count_before"] = {"error": repr(e)}
-    try:
-        code, js = http_post_json(base + "/api/click", {"user_id": 123})
-        out["click_once"] = {"status": code, "json": js}
-    except Exception as e:
-        out["click_once"] = {"error": repr(e)}
-    try:
-        code, js = http_post_json(base + "/api/count", {"user_id": 123})
-        out["count_after"] = {"status": code, "json": js}
-    except Exception as e:
-        out["count_after"] = {"error": repr(e)}
+    # One session, so the three probes share a keep-alive connection
+    async with aiohttp.ClientSession(
+        timeout=aiohttp.ClientTimeout(total=timeout),
+        json_serialize=lambda obj: orjson.dumps(obj).decode(),
+    ) as session:
+        for key, path in (("count_before", "/api/count"), ("click_once", "/api/click"), ("count_after", "/api/count")):
+            try:
+                code, js = await http_post_json(session, base + path, {"user_id": 123})
+                out[key] = {"status": code, "json": js}
+            except Exception as e:
+                out[key] = {"error": repr(e)}
     return out
 
 
+async def check_all():
+    # Flask and Telegram checks are independent, run them side by side
+    return await asyncio.gather(check_flask(), check_bot())
+
+
+def dump_json(obj) -> str:
+    return orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS).decode()
+
+
 def main():
     load_dotenv()
     root = Path(__file__).resolve().parent
@@ -84,13 +96,13 @@ def main():
     print("LOG FILES:")
     print("  ", logs)
 
+    f, b = asyncio.run(check_all())
+
     print("\n=== Flask health ===")
-    f = check_flask()
-    print(json.dumps(f, ensure_ascii=False, indent=2))
+    print(dump_json(f))
 
     print("\n=== Bot health ===")
-    b = asyncio.run(check_bot())
-    print(json.dumps(b, ensure_ascii=False, indent=2))
+    print(dump_json(b))
 
     print("\n=== Tail flask.log ===")
     print(tail_file(logs / 'flask.log', 200))
@@ -1,7 +1,16 @@
 # Gunicorn configuration for Render
-bind = "0.0.0.0:10000"
-workers = 1
+import os
+
+bind = [f"0.0.0.0:{os.environ.get('PORT', '10000')}"]
+# Optional local socket for same-host clients (bot, reverse proxy), skips the TCP stack
+if os.environ.get("APP_SOCKET"):
+    bind.append(f"unix:{os.environ['APP_SOCKET']}")
+workers = int(os.environ.get("WEB_CONCURRENCY", 1))
+# Threaded workers; each thread keeps its own SQLite connection (see get_db_connection)
+worker_class = "gthread"
+threads = 4
+preload_app = True
 timeout = 120
 keepalive = 2
 max_requests = 1000
-max_requests_jitter = 100
\ No newline at end of file
+max_requests_jitter = 100
@@ -7,17 +7,22 @@ import asyncio
 import logging
 import os
 import sys
-import threading
 from datetime import datetime
 
 # Add project root to path
 project_root = os.path.dirname(__file__)
 sys.path.insert(0, project_root)
 
+# The web app shares this process and its database, let the bot call it directly
+os.environ.setdefault("BOT_INPROC_API", "true")
+
 # Import our modules
 from bot.bot import main as bot_main
 from scheduler import SpacedRepetitionScheduler
-from webapp.app import create_app
+# The module-level app, the same instance the bot calls in-process
+from webapp.app import app as flask_app
+from hypercorn.asyncio import serve
+from hypercorn.config import Config
 
 # Configure logging
 logging.basicConfig(
@@ -31,56 +36,46 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-def run_flask_app():
-    """Run Flask app with Gunicorn in separate thread"""
-    try:
-        import subprocess
-        port = int(os.environ.get("PORT", 8000))
-        
-        # Use Gunicorn for production
-        cmd = [
-            "gunicorn",
-            "--bind", f"0.0.0.0:{port}",
-            "--workers", "1",
-            "--timeout", "120",
-            "--keep-alive", "5",
-            "--max-requests", "1000",
-            "--preload",
-            "webapp.app:app"
-        ]
-        
-        logger.info(f"Starting Gunicorn server on port {port}")
-        subprocess.run(cmd, check=True)
-        
-    except Exception as e:
-        logger.error(f"Gunicorn server crashed: {e}")
-        # Fallback to Flask dev server
-        logger.info("Falling back to Flask development server")
-        app = create_app()
-        port = int(os.environ.get("PORT", 8000))
-        app.run(host="0.0.0.0", port=port, debug=False, use_reloader=False)
+async def run_web_app():
+    """Serve Flask through Hypercorn on the same event loop as the bot"""
+    port = int(os.environ.get("PORT", 8000))
+    config = Config()
+    config.bind = [f"0.0.0.0:{port}"]
+    # Extra local socket so the bot can skip the TCP stack for API calls
+    app_socket = os.environ.get("APP_SOCKET")
+    if app_socket:
+        config.bind.append(f"unix:{app_socket}")
+    config.keep_alive_timeout = 5
+
+    logger.info(f"Starting Hypercorn server on port {port}")
+    # WSGI mode runs each request on the loop's default thread pool, so blocking
+    # views execute concurrently. Passing a shutdown trigger keeps Hypercorn from
+    # installing its own signal handlers, so Ctrl+C stops all services together
+    await serve(flask_app, config, shutdown_trigger=asyncio.Event().wait, mode="wsgi")
 
 
 async def run_scheduler(scheduler):
     """Run scheduler in background"""
-    try:
-        await scheduler.start()
-    except Exception as e:
-        logger.error(f"Scheduler crashed: {e}")
-        # Restart scheduler after 60 seconds
-        await asyncio.sleep(60)
-        await run_scheduler(scheduler)
+    while True:
+        try:
+            await scheduler.start()
+            return
+        except Exception as e:
+            logger.error(f"Scheduler crashed: {e}")
+            # Restart scheduler after 60 seconds
+            await asyncio.sleep(60)
 
 
 async def run_bot():
     """Run Telegram bot"""
-    try:
-        await bot_main()
-    except Exception as e:
-        logger.error(f"Bot crashed: {e}")
-        # Restart bot after 30 seconds
-        await asyncio.sleep(30)
-        await run_bot()
+    while True:
+        try:
+            await bot_main()
+            return
+        except Exception as e:
+            logger.error(f"Bot crashed: {e}")
+            # Restart bot after 30 seconds
+            await asyncio.sleep(30)
 
 
 async def main_async():
@@ -97,10 +92,11 @@ async def main_async():
     scheduler = SpacedRepetitionScheduler()
     
     try:
-        # Run bot and scheduler concurrently
+        # Run bot, scheduler and web app concurrently
         await asyncio.gather(
             run_bot(),                    # Bot polling
-            run_scheduler(scheduler)      # Scheduler background task
+            run_scheduler(scheduler),     # Scheduler background task
+            run_web_app()                 # Flask API
         )
     except KeyboardInterrupt:
         logger.info("Shutting down async services...")
@@ -114,14 +110,15 @@ def main():
     """Main entry point"""
     logger.info("Starting all services...")
     
-    # Start Flask in separate thread
-    flask_thread = threading.Thread(target=run_flask_app, daemon=True)
-    flask_thread.start()
-    logger.info("Flask API started in background thread")
-    
-    # Run async services in main thread
+    # Run async services in main thread (on uvloop when installed)
     try:
-        asyncio.run(main_async())
+        try:
+            import uvloop
+        except ImportError:
+            asyncio.run(main_async())
+        else:
+            with asyncio.Runner(loop_factory=uvloop.new_event_loop) as runner:
+                runner.run(main_async())
     except KeyboardInterrupt:
         logger.info("Stopped by user")
     except Exception as e:
@@ -5,17 +5,23 @@ Spaced Repetition Scheduler
 """
 
 import asyncio
+import atexit
+import functools
 import logging
-import sqlite3
-import json
 import os
+import queue
 from datetime import datetime, date, time, timedelta
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 from dataclasses import dataclass
+from logging.handlers import QueueHandler, QueueListener
 
 import aiohttp
+import aiosqlite
+import orjson
 from dotenv import load_dotenv
 
+from bot._common import telegram_bucket
+
 # Load environment variables
 load_dotenv()
 
@@ -23,23 +29,108 @@ load_dotenv()
 DB_PATH = os.path.join(os.path.dirname(__file__), "webapp", "counter.db")
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 CHECK_INTERVAL = int(os.getenv("SCHEDULER_INTERVAL", "3600"))  # Check every hour by default (configurable)
+SEND_CONCURRENCY = 20  # Users whose reminders are being sent at the same time
 LOG_FILE = os.path.join(os.path.dirname(__file__), "logs", "scheduler.log")
 
 # Ensure logs directory exists
 os.makedirs(os.path.dirname(LOG_FILE), exist_ok=True)
 
-# Configure logging
+# Configure logging; the event loop only enqueues records, a listener thread does the I/O
+_log_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+_log_handlers = [
+    logging.FileHandler(LOG_FILE, encoding='utf-8'),
+    logging.StreamHandler()
+]
+for _handler in _log_handlers:
+    _handler.setFormatter(_log_formatter)
+_log_queue = queue.SimpleQueue()
+_log_listener = QueueListener(_log_queue, *_log_handlers)
+_log_listener.start()
+atexit.register(_log_listener.stop)
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(LOG_FILE, encoding='utf-8'),
-        logging.StreamHandler()
-    ]
+    format='%(message)s',
+    handlers=[QueueHandler(_log_queue)]
 )
 logger = logging.getLogger(__name__)
 
 
+# Queries run every check. Keeping the text fixed lets sqlite3's per-connection
+# statement cache reuse the compiled statements on the long-lived connection.
+SQL_DB_TOTALS = """
+    SELECT (SELECT COUNT(*) FROM users) AS users,
+           (SELECT COUNT(*) FROM cards) AS cards,
+           (SELECT COUNT(*) FROM study_sessions) AS sessions
+"""
+
+# Due and new card counts for every user with notifications on, in one pass
+SQL_USERS_TO_REMIND = """
+    SELECT u.user_id,
+           COALESCE(us.study_reminder_time, '09:00') AS reminder_time,
+           COUNT(CASE WHEN c.next_review_date <= ? THEN 1 END) AS due_count,
+           COUNT(CASE WHEN c.next_review_date IS NULL THEN 1 END) AS new_count
+    FROM users u
+    LEFT JOIN user_settings us ON us.user_id = u.user_id
+    JOIN cards c ON c.user_id = u.user_id
+    -- Skip users already reminded today (avoid spam)
+    LEFT JOIN reminder_log rl ON rl.user_id = u.user_id AND rl.sent_date = ?
+    WHERE COALESCE(us.notifications_enabled, 1) = 1
+    AND rl.user_id IS NULL
+    GROUP BY u.user_id
+    HAVING due_count > 0 OR new_count > 0
+"""
+
+SQL_DUE_CARDS = """
+    WITH latest AS (
+        SELECT card_id, MAX(id) AS sid, COUNT(*) AS repetitions
+        FROM study_sessions
+        WHERE card_id IN (SELECT id FROM cards WHERE user_id = ?)
+        GROUP BY card_id
+    )
+    SELECT c.id, c.front, c.back, c.created_at,
+           s.quality, s.next_review_date, l.repetitions
+    FROM cards c
+    JOIN latest l ON l.card_id = c.id
+    JOIN study_sessions s ON s.id = l.sid
+    WHERE c.user_id = ? AND s.next_review_date <= ?
+    ORDER BY s.next_review_date ASC
+    LIMIT ?
+"""
+
+SQL_RECORD_REMINDER = "INSERT OR IGNORE INTO reminder_log (user_id, sent_date) VALUES (?, ?)"
+
+
+# Message templates
+REMINDER_TMPL = """🧠 <b>Время изучения!</b>
+
+{cards_info}
+
+💡 <i>Интервальное повторение работает лучше всего при регулярном изучении. Всего 5-10 минут в день помогут вам надолго запомнить материал!</i>
+
+🚀 Начните изучение в Mini App"""
+CARDS_REMINDER_TMPL = """📖 <b>Время повторить карточки!</b>
+
+{cards_text}
+
+💡 <i>Нажмите кнопку ниже, чтобы изучить карточку</i>"""
+CARD_BLOCK_TMPL = """<b>{status}</b>
+<b>Слово:</b> <code>{front}</code>
+<b>Перевод:</b> <i>{back}</i>"""
+# Card status by number of repetitions; later ones are numbered
+CARD_STATUSES = ("✨ Новая карточка", "🔄 Первое повторение", "📚 2-е повторение", "📚 3-е повторение")
+
+
+@functools.lru_cache(maxsize=256)
+def _general_reminder_text(due_count: int, new_count: int) -> str:
+    if due_count > 0 and new_count > 0:
+        cards_info = f"📚 {due_count} к повторению • ✨ {new_count} новых"
+    elif due_count > 0:
+        cards_info = f"📚 {due_count} карточек к повторению"
+    else:
+        cards_info = f"✨ {new_count} новых карточек"
+    return REMINDER_TMPL.format(cards_info=cards_info)
+
+
 @dataclass
 class UserReminder:
     """User reminder data"""
@@ -56,15 +147,31 @@ class SpacedRepetitionScheduler:
     
     def __init__(self):
         self.session: Optional[aiohttp.ClientSession] = None
+        self.db: Optional[aiosqlite.Connection] = None
         self.running = False
+        self._send_sem = asyncio.Semaphore(SEND_CONCURRENCY)
+        # Same bucket as the bot's Bot API calls when both run under main.py
+        self._rate_limiter = telegram_bucket
         
     async def start(self):
         """Start the scheduler"""
         logger.info("Starting Spaced Repetition Scheduler...")
         self.running = True
-        self.session = aiohttp.ClientSession()
+        # One keep-alive pool to api.telegram.org for every reminder
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=50,
+                limit_per_host=20,
+                ttl_dns_cache=300,
+                keepalive_timeout=75,
+                enable_cleanup_closed=True,
+            ),
+            timeout=aiohttp.ClientTimeout(total=10),
+            json_serialize=lambda obj: orjson.dumps(obj).decode(),
+        )
         
         try:
+            await self._open_db()
             await self._run_scheduler()
         except KeyboardInterrupt:
             logger.info("Scheduler stopped by user")
@@ -79,6 +186,21 @@ class SpacedRepetitionScheduler:
         self.running = False
         if self.session:
             await self.session.close()
+        if self.db:
+            await self.db.close()
+            self.db = None
+    
+    async def _open_db(self):
+        """Open the long-lived database connection reused by every check"""
+        self.db = await aiosqlite.connect(DB_PATH)
+        self.db.row_factory = aiosqlite.Row
+        await self.db.execute("PRAGMA journal_mode=WAL")
+        await self.db.execute("PRAGMA synchronous=NORMAL")
+        await self.db.execute("PRAGMA temp_store=MEMORY")
+        await self.db.execute("PRAGMA cache_size=-64000")
+        # Tables and indexes (reminder_log included) are created by webapp.app.init_db;
+        # give the query planner statistics for them
+        await self.db.execute("ANALYZE")
     
     async def _run_scheduler(self):
         """Main scheduler loop"""
@@ -87,15 +209,21 @@ class SpacedRepetitionScheduler:
         while self.running:
             try:
                 await self._check_and_send_reminders()
-                await asyncio.sleep(CHECK_INTERVAL)
+                await asyncio.sleep(self._seconds_until_next_check())
             except Exception as e:
                 logger.error(f"Error in scheduler loop: {e}")
                 await asyncio.sleep(60)  # Wait 1 minute before retrying
     
+    def _seconds_until_next_check(self) -> float:
+        """CHECK_INTERVAL, shortened so the first check of a new day runs right after midnight"""
+        now = datetime.now()
+        next_day = datetime.combine(now.date() + timedelta(days=1), time.min)
+        return max(10, min(CHECK_INTERVAL, (next_day - now).total_seconds() + 1))
+    
     async def _check_and_send_reminders(self):
         """Check for users needing reminders and send them"""
         logger.info("Checking for users needing reminders...")
-        users_to_remind = self._get_users_needing_reminders()
+        users_to_remind = await self._get_users_needing_reminders()
         
         if not users_to_remind:
             logger.info("No users need reminders at this time")
@@ -103,140 +231,62 @@ class SpacedRepetitionScheduler:
         
         logger.info(f"Found {len(users_to_remind)} users needing reminders")
         
-        for user in users_to_remind:
+        # Send to several users at once, each one still gets its cards in order
+        sent = await asyncio.gather(*(self._send_one(user) for user in users_to_remind))
+        await self._update_last_reminder([user_id for user_id in sent if user_id is not None])
+    
+    async def _send_one(self, user: UserReminder) -> Optional[int]:
+        """Send one user's reminder, returns the user_id if it was sent"""
+        async with self._send_sem:
             try:
                 await self._send_reminder(user)
-                self._update_last_reminder(user.user_id)
                 logger.info(f"Sent reminder to user {user.user_id}")
+                return user.user_id
             except Exception as e:
                 logger.error(f"Failed to send reminder to user {user.user_id}: {e}")
+                return None
     
-    def _get_users_needing_reminders(self) -> List[UserReminder]:
+    async def _get_users_needing_reminders(self) -> List[UserReminder]:
         """Get users who have cards due for review TODAY (Spaced Repetition logic)"""
         current_date = date.today().isoformat()
         
         try:
-            with sqlite3.connect(DB_PATH) as conn:
-                conn.row_factory = sqlite3.Row
-                
-                # Database diagnostics
-                total_users = conn.execute("SELECT COUNT(*) as count FROM users").fetchone()['count']
-                total_cards = conn.execute("SELECT COUNT(*) as count FROM cards").fetchone()['count']
-                total_sessions = conn.execute("SELECT COUNT(*) as count FROM study_sessions").fetchone()['count']
-                
-                logger.info(f"DATABASE: {total_users} users, {total_cards} cards, {total_sessions} sessions")
-                
-                # Get users who have cards due TODAY or new cards to study
-                users = conn.execute("""
-                    SELECT DISTINCT u.user_id,
-                           COALESCE(us.notifications_enabled, 1) as notifications_enabled
-                    FROM users u
-                    LEFT JOIN user_settings us ON u.user_id = us.user_id
-                    WHERE COALESCE(us.notifications_enabled, 1) = 1
-                    AND (
-                        -- User has cards due today
-                        EXISTS (
-                            SELECT 1 FROM cards c
-                            JOIN study_sessions s ON c.id = s.card_id
-                            WHERE c.user_id = u.user_id 
-                            AND s.next_review_date <= ?
-                            AND s.id = (SELECT MAX(id) FROM study_sessions WHERE card_id = c.id)
-                        )
-                        OR
-                        -- User has new cards (never studied)
-                        EXISTS (
-                            SELECT 1 FROM cards c
-                            LEFT JOIN study_sessions s ON c.id = s.card_id
-                            WHERE c.user_id = u.user_id AND s.card_id IS NULL
-                        )
-                    )
-                """, (current_date,)).fetchall()
-                
-                logger.info(f"Found {len(users)} users with cards due today or new cards")
-                
-                users_to_remind = []
-                
-                for user_row in users:
-                    user_id = user_row['user_id']
-                    
-                    # Skip if notifications disabled
-                    if not user_row['notifications_enabled']:
-                        continue
-                    
-                    # Check if already reminded today (avoid spam)
-                    if self._was_reminded_today(user_id):
-                        logger.info(f"User {user_id} already reminded today, skipping")
-                        continue
-                    
-                    # Get due and new card counts
-                    due_count = self._get_due_cards_count(conn, user_id, current_date)
-                    new_count = self._get_new_cards_count(conn, user_id)
-                    
-                    logger.info(f"User {user_id}: {due_count} due cards, {new_count} new cards")
-                    
-                    # Only remind if there are cards to study
-                    if due_count > 0 or new_count > 0:
-                        users_to_remind.append(UserReminder(
-                            user_id=user_id,
-                            due_count=due_count,
-                            new_count=new_count,
-                            last_reminder=None,
-                            reminder_time="any_time",  # Spaced repetition doesn't depend on time
-                            notifications_enabled=True
-                        ))
+            # Database diagnostics
+            (totals,) = await self.db.execute_fetchall(SQL_DB_TOTALS)
+            total_users, total_cards, total_sessions = totals['users'], totals['cards'], totals['sessions']
+            
+            logger.info(f"DATABASE: {total_users} users, {total_cards} cards, {total_sessions} sessions")
+            
+            users = await self.db.execute_fetchall(SQL_USERS_TO_REMIND, (current_date, current_date))
+            
+            logger.info(f"Found {len(users)} users with cards due today or new cards, not yet reminded")
+            
+            users_to_remind = []
+            
+            for user_row in users:
+                user_id = user_row['user_id']
+                due_count = user_row['due_count']
+                new_count = user_row['new_count']
                 
-                return users_to_remind
+                logger.info(f"User {user_id}: {due_count} due cards, {new_count} new cards")
                 
+                users_to_remind.append(UserReminder(
+                    user_id=user_id,
+                    due_count=due_count,
+                    new_count=new_count,
+                    last_reminder=None,
+                    reminder_time=user_row['reminder_time'],
+                    notifications_enabled=True
+                ))
+            
+            return users_to_remind
+            
         except Exception as e:
             logger.error(f"Error getting users for reminders: {e}")
             return []
     
     # NOTE: Time-based reminders removed - Spaced Repetition works by card due dates, not time
     
-    def _was_reminded_today(self, user_id: int) -> bool:
-        """Check if user was already reminded today"""
-        try:
-            reminder_file = os.path.join(os.path.dirname(__file__), "logs", "reminders.log")
-            today_str = date.today().isoformat()
-            
-            if not os.path.exists(reminder_file):
-                return False
-            
-            with open(reminder_file, 'r', encoding='utf-8') as f:
-                for line in f:
-                    if f"{today_str}:{user_id}" in line:
-                        return True
-            return False
-            
-        except Exception as e:
-            logger.error(f"Error checking reminder history: {e}")
-            return False
-    
-    def _get_due_cards_count(self, conn: sqlite3.Connection, user_id: int, current_date: str) -> int:
-        """Get count of cards due for review"""
-        result = conn.execute("""
-            SELECT COUNT(DISTINCT c.id) as count
-            FROM cards c
-            JOIN study_sessions s ON c.id = s.card_id
-            WHERE c.user_id = ? AND s.next_review_date <= ?
-            AND s.id IN (
-                SELECT MAX(id) FROM study_sessions 
-                WHERE card_id = c.id GROUP BY card_id
-            )
-        """, (user_id, current_date)).fetchone()
-        
-        return result['count'] if result else 0
-    
-    def _get_new_cards_count(self, conn: sqlite3.Connection, user_id: int) -> int:
-        """Get count of new cards (never studied)"""
-        result = conn.execute("""
-            SELECT COUNT(*) as count FROM cards c 
-            LEFT JOIN study_sessions s ON c.id = s.card_id 
-            WHERE c.user_id = ? AND s.card_id IS NULL
-        """, (user_id,)).fetchone()
-        
-        return result['count'] if result else 0
-    
     async def _send_reminder(self, user: UserReminder):
         """Send reminder message via Telegram with interactive cards"""
         if not BOT_TOKEN:
@@ -244,24 +294,20 @@ class SpacedRepetitionScheduler:
             return
         
         # Get specific cards to study
-        due_cards = self._get_due_cards_for_user(user.user_id, limit=5)
+        due_cards = await self._get_due_cards_for_user(user.user_id, limit=5)
         
         if not due_cards:
             # No specific cards, send general reminder
             await self._send_general_reminder(user)
             return
         
-        # Send individual card reminders
-        for card in due_cards:
-            await self._send_card_reminder(user.user_id, card)
-            await asyncio.sleep(0.5)  # Prevent rate limiting
+        # One message listing all due cards, one button per card
+        await self._send_card_reminder(user.user_id, due_cards)
     
     async def _send_general_reminder(self, user: UserReminder):
         """Send general reminder without specific cards"""
         message = self._create_reminder_message(user)
         
-        url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
-        
         payload = {
             "chat_id": user.user_id,
             "text": message,
@@ -269,19 +315,16 @@ class SpacedRepetitionScheduler:
             "disable_notification": False
         }
         
-        async with self.session.post(url, json=payload) as resp:
-            if resp.status == 200:
-                logger.debug(f"General reminder sent successfully to user {user.user_id}")
-            else:
-                error_text = await resp.text()
-                logger.error(f"Failed to send general reminder to user {user.user_id}: {resp.status} - {error_text}")
+        status, error_text = await self._send_message(payload)
+        if status == 200:
+            logger.debug(f"General reminder sent successfully to user {user.user_id}")
+        else:
+            logger.error(f"Failed to send general reminder to user {user.user_id}: {status} - {error_text}")
     
-    async def _send_card_reminder(self, user_id: int, card: dict):
-        """Send reminder for specific card with interactive button"""
-        message = self._create_card_reminder_message(card)
-        inline_keyboard = self._create_card_keyboard(card)
-        
-        url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
+    async def _send_card_reminder(self, user_id: int, cards: List[dict]):
+        """Send reminder for specific cards with an interactive button per card"""
+        message = self._create_card_reminder_message(cards)
+        inline_keyboard = self._create_card_keyboard(cards)
         
         payload = {
             "chat_id": user_id,
@@ -291,125 +334,101 @@ class SpacedRepetitionScheduler:
             "reply_markup": inline_keyboard
         }
         
-        async with self.session.post(url, json=payload) as resp:
-            if resp.status == 200:
-                logger.debug(f"Card reminder sent successfully to user {user_id}, card {card['id']}")
-            else:
-                error_text = await resp.text()
-                logger.error(f"Failed to send card reminder to user {user_id}: {resp.status} - {error_text}")
+        status, error_text = await self._send_message(payload)
+        if status == 200:
+            logger.debug(f"Card reminder sent successfully to user {user_id}, {len(cards)} cards")
+        else:
+            logger.error(f"Failed to send card reminder to user {user_id}: {status} - {error_text}")
+    
+    async def _send_message(self, payload: dict) -> Tuple[int, str]:
+        """POST sendMessage within the rate limit, retrying once after a 429"""
+        url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
+        for attempt in range(2):
+            await self._rate_limiter.acquire()
+            async with self.session.post(url, json=payload) as resp:
+                body = await resp.text()
+                if resp.status != 429 or attempt:
+                    return resp.status, body
+            try:
+                retry_after = orjson.loads(body)["parameters"]["retry_after"]
+            except (ValueError, KeyError, TypeError):
+                retry_after = 1
+            logger.warning(f"Rate limited by Telegram, retrying in {retry_after}s")
+            await asyncio.sleep(retry_after)
     
     def _create_reminder_message(self, user: UserReminder) -> str:
         """Create personalized reminder message"""
-        total_cards = user.due_count + user.new_count
-        
-        if user.due_count > 0 and user.new_count > 0:
-            cards_info = f"📚 {user.due_count} к повторению • ✨ {user.new_count} новых"
-        elif user.due_count > 0:
-            cards_info = f"📚 {user.due_count} карточек к повторению"
-        else:
-            cards_info = f"✨ {user.new_count} новых карточек"
-        
-        message = f"""🧠 <b>Время изучения!</b>
-
-{cards_info}
-
-💡 <i>Интервальное повторение работает лучше всего при регулярном изучении. Всего 5-10 минут в день помогут вам надолго запомнить материал!</i>
-
-🚀 Начните изучение в Mini App"""
-        
-        return message
+        return _general_reminder_text(user.due_count, user.new_count)
     
-    def _get_due_cards_for_user(self, user_id: int, limit: int = 5) -> List[dict]:
+    async def _get_due_cards_for_user(self, user_id: int, limit: int = 5) -> List[dict]:
         """Get specific cards that are due for review"""
         current_date = date.today().isoformat()
         
         try:
-            with sqlite3.connect(DB_PATH) as conn:
-                conn.row_factory = sqlite3.Row
-                
-                # Get due cards with details
-                due_cards = conn.execute("""
-                    SELECT DISTINCT c.id, c.front, c.back, c.created_at,
-                           s.quality, s.next_review_date, s.repetitions
-                    FROM cards c
-                    JOIN study_sessions s ON c.id = s.card_id
-                    WHERE c.user_id = ? AND s.next_review_date <= ?
-                    AND s.id IN (
-                        SELECT MAX(id) FROM study_sessions 
-                        WHERE card_id = c.id GROUP BY card_id
-                    )
-                    ORDER BY s.next_review_date ASC
-                    LIMIT ?
-                """, (user_id, current_date, limit)).fetchall()
-                
-                # Convert to list of dicts
-                cards = []
-                for row in due_cards:
-                    cards.append({
-                        'id': row['id'],
-                        'front': row['front'],
-                        'back': row['back'],
-                        'quality': row['quality'],
-                        'repetitions': row['repetitions'],
-                        'next_review_date': row['next_review_date']
-                    })
-                
-                return cards
-                
+            # Get due cards with details
+            due_cards = await self.db.execute_fetchall(SQL_DUE_CARDS, (user_id, user_id, current_date, limit))
+            
+            # Convert to list of dicts
+            cards = []
+            for row in due_cards:
+                cards.append({
+                    'id': row['id'],
+                    'front': row['front'],
+                    'back': row['back'],
+                    'quality': row['quality'],
+                    'repetitions': row['repetitions'],
+                    'next_review_date': row['next_review_date']
+                })
+            
+            return cards
+            
         except Exception as e:
             logger.error(f"Error getting due cards for user {user_id}: {e}")
             return []
     
-    def _create_card_reminder_message(self, card: dict) -> str:
-        """Create message for specific card reminder"""
-        repetitions = card.get('repetitions', 0)
-        if repetitions == 0:
-            status = "✨ Новая карточка"
-        elif repetitions == 1:
-            status = "🔄 Первое повторение"
-        elif repetitions <= 3:
-            status = f"📚 {repetitions}-е повторение"
-        else:
-            status = f"🎯 Повторение #{repetitions}"
-        
-        message = f"""📖 <b>Время повторить карточку!</b>
-
-<b>{status}</b>
-
-<b>Слово:</b> <code>{card['front']}</code>
-<b>Перевод:</b> <i>{card['back']}</i>
-
-💡 <i>Нажмите кнопку ниже, чтобы изучить эту карточку</i>"""
+    def _create_card_reminder_message(self, cards: List[dict]) -> str:
+        """Create message for specific cards reminder"""
+        blocks = []
+        for card in cards:
+            repetitions = card.get('repetitions', 0)
+            if repetitions < len(CARD_STATUSES):
+                status = CARD_STATUSES[repetitions]
+            else:
+                status = f"🎯 Повторение #{repetitions}"
+            blocks.append(CARD_BLOCK_TMPL.format(status=status, front=card['front'], back=card['back']))
         
-        return message
+        return CARDS_REMINDER_TMPL.format(cards_text="\n\n".join(blocks))
     
-    def _create_card_keyboard(self, card: dict) -> dict:
+    def _create_card_keyboard(self, cards: List[dict]) -> dict:
         """Create inline keyboard for card interaction"""
-        return {
-            "inline_keyboard": [
-                [
-                    {
-                        "text": "🚀 Изучить карточку",
-                        "callback_data": f"study_card_{card['id']}"
-                    }
-                ],
-                [
-                    {
-                        "text": "📚 Открыть все карточки",
-                        "url": f"{os.getenv('APP_URL', 'http://localhost:8000')}/study.html"
-                    }
-                ]
+        rows = [
+            [
+                {
+                    "text": f"🚀 {card['front']}",
+                    "callback_data": f"study_card_{card['id']}"
+                }
             ]
-        }
+            for card in cards
+        ]
+        rows.append([
+            {
+                "text": "📚 Открыть все карточки",
+                "url": f"{os.getenv('APP_URL', 'http://localhost:8000')}/study.html"
+            }
+        ])
+        return {"inline_keyboard": rows}
     
-    def _update_last_reminder(self, user_id: int):
-        """Update last reminder timestamp for spam protection"""
+    async def _update_last_reminder(self, user_ids: List[int]):
+        """Record today's reminders for spam protection, one transaction per check"""
+        if not user_ids:
+            return
         try:
-            reminder_file = os.path.join(os.path.dirname(__file__), "logs", "reminders.log")
-            timestamp = datetime.now().isoformat()
-            
-            with open(reminder_file, 'a', encoding='utf-8') as f:
-                f.write(f"{timestamp}:{user_id}\n")
+            today = date.today().isoformat()
+            await self.db.executemany(
+                SQL_RECORD_REMINDER,
+                [(user_id, today) for user_id in user_ids]
+            )
+            await self.db.commit()
                 
         except Exception as e:
             logger.error(f"Error updating reminder log: {e}")
@@ -431,7 +450,13 @@ async def main():
 
 if __name__ == "__main__":
     try:
-        asyncio.run(main())
+        try:
+            import uvloop
+        except ImportError:
+            asyncio.run(main())
+        else:
+            with asyncio.Runner(loop_factory=uvloop.new_event_loop) as runner:
+                runner.run(main())
     except KeyboardInterrupt:
         logger.info("Scheduler stopped by user")
     except Exception as e:
@@ -1,22 +1,29 @@
+import atexit
+import functools
 import hashlib
 import hmac
-import json
 import os
+import queue
 import sqlite3
+import threading
 import time
 import urllib.parse
 from typing import Optional, Tuple
-from datetime import datetime, date, timedelta
+from datetime import datetime, date
 
 import logging
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+import orjson
 from flask import Flask, jsonify, request, send_from_directory
+from flask.json.provider import DefaultJSONProvider
 
 
 BASE_DIR = os.path.dirname(__file__)
 # Ensure database is stored in a persistent location
 DB_PATH = os.path.join(BASE_DIR, "counter.db")
 EXPORTS_DIR = os.path.join(BASE_DIR, "exports")
+DEV_DEFAULT_USER_ID = 234195742  # Used in DEV_MODE when the request names no user
+INIT_DATA_MAX_AGE = 86400  # Seconds a signed initData (its auth_date) stays valid
 
 # Create directories if they don't exist
 os.makedirs(BASE_DIR, exist_ok=True)
@@ -32,8 +39,15 @@ def setup_logging(app: Flask) -> None:
         formatter = logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s')
         file_handler.setFormatter(formatter)
 
-        app.logger.addHandler(file_handler)
-        logging.getLogger('werkzeug').addHandler(file_handler)
+        # Request threads only enqueue records; a single listener thread writes the file
+        log_queue = queue.SimpleQueue()
+        queue_handler = QueueHandler(log_queue)
+        listener = QueueListener(log_queue, file_handler, respect_handler_level=True)
+        listener.start()
+        atexit.register(listener.stop)
+
+        app.logger.addHandler(queue_handler)
+        logging.getLogger('werkzeug').addHandler(queue_handler)
         app.logger.setLevel(logging.INFO)
         logging.getLogger('werkzeug').setLevel(logging.INFO)
         app.logger.info('Flask logging configured')
@@ -42,8 +56,21 @@ def setup_logging(app: Flask) -> None:
         pass
 
 
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson for jsonify() and request.get_json()"""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
 def create_app() -> Flask:
     app = Flask(__name__, static_folder=os.path.join(BASE_DIR, "static"), static_url_path="")
+    app.json = OrjsonProvider(app)
+    # Behind a proxy that honours X-Sendfile, send_from_directory() hands files to it instead of streaming them
+    app.config["USE_X_SENDFILE"] = os.getenv("USE_X_SENDFILE", "false").lower() == "true"
 
     setup_logging(app)
     # Ensure DB and exports dir exist
@@ -52,6 +79,9 @@ def create_app() -> Flask:
 
     @app.before_request
     def _before():
+        # Skip the timing and the header/query-string formatting when INFO is filtered out
+        if not app.logger.isEnabledFor(logging.INFO):
+            return
         g_start = time.perf_counter()
         # stash start time in environ to avoid importing g from Flask here
         request.environ['__t0'] = g_start
@@ -66,6 +96,8 @@ def create_app() -> Flask:
 
     @app.after_request
     def _after(resp):
+        if not app.logger.isEnabledFor(logging.INFO):
+            return resp
         t0 = request.environ.get('__t0')
         dt = (time.perf_counter() - t0) * 1000 if isinstance(t0, float) else -1.0
         app.logger.info(
@@ -89,11 +121,12 @@ def create_app() -> Flask:
         """Create a new flashcard"""
         user_id = extract_user_id_from_request()
         if user_id is None:
-            app.logger.warning("CREATE_CARD unauthorized headers=%s body=%s", dict(request.headers), _safe_body())
+            if app.logger.isEnabledFor(logging.WARNING):
+                app.logger.warning("CREATE_CARD unauthorized headers=%s body=%s", dict(request.headers), _safe_body())
             return jsonify({"ok": False, "error": "unauthorized"}), 401
             
         try:
-            data = request.get_json()
+            data = _request_payload()
             front = data.get("front", "").strip()
             back = data.get("back", "").strip()
             
@@ -152,7 +185,7 @@ def create_app() -> Flask:
             return jsonify({"ok": False, "error": "unauthorized"}), 401
             
         try:
-            data = request.get_json()
+            data = _request_payload()
             quality = data.get("quality")
             
             if quality is None or not (1 <= quality <= 5):
@@ -166,6 +199,29 @@ def create_app() -> Flask:
             app.logger.error("REVIEW_CARD error user_id=%s card_id=%s: %s", user_id, card_id, e)
             return jsonify({"ok": False, "error": "server error"}), 500
 
+    @app.post("/api/cards/review/bulk")
+    def api_review_cards_bulk():
+        """Record a batch of reviews coalesced by the bot"""
+        # Items belong to different users, so the bot authenticates as a service instead of with initData
+        if not is_service_request():
+            if app.logger.isEnabledFor(logging.WARNING):
+                app.logger.warning("REVIEW_CARDS_BULK unauthorized ip=%s", request.remote_addr)
+            return jsonify({"ok": False, "error": "unauthorized"}), 401
+            
+        try:
+            data = _request_payload()
+            reviews = data.get("reviews")
+            if not isinstance(reviews, list):
+                return jsonify({"ok": False, "error": "reviews must be a list"}), 400
+                
+            results = review_cards_bulk(reviews)
+            app.logger.info("REVIEW_CARDS_BULK count=%s reviewed=%s", len(reviews), sum(results))
+            return jsonify({"ok": True, "results": results})
+            
+        except Exception as e:
+            app.logger.error("REVIEW_CARDS_BULK error: %s", e)
+            return jsonify({"ok": False, "error": "server error"}), 500
+
     @app.get("/api/stats")
     def api_get_stats():
         """Get user study statistics"""
@@ -187,63 +243,16 @@ def create_app() -> Flask:
         """Bulk create cards from new_words.json file"""
         user_id = extract_user_id_from_request()
         if user_id is None:
-            app.logger.warning("BULK_CREATE unauthorized headers=%s body=%s", dict(request.headers), _safe_body())
+            if app.logger.isEnabledFor(logging.WARNING):
+                app.logger.warning("BULK_CREATE unauthorized headers=%s body=%s", dict(request.headers), _safe_body())
             return jsonify({"ok": False, "error": "unauthorized"}), 401
             
         try:
-            words_file_path = os.path.join(os.path.dirname(BASE_DIR), "new_words.json")
-            
-            if not os.path.exists(words_file_path):
-                return jsonify({"ok": False, "error": "new_words.json file not found"}), 404
-                
-            with open(words_file_path, 'r', encoding='utf-8') as f:
-                words_data = json.load(f)
-            
-            cards = words_data.get('cards', [])
-            if not cards:
-                return jsonify({"ok": False, "error": "No cards found in file"}), 400
-                
-            created_count = 0
-            ensure_user_exists(user_id)
+            result, status = import_new_words(user_id)
+            if result.get("ok"):
+                app.logger.info("BULK_CREATE user_id=%s created=%s total_cards=%s", user_id, result["created"], result["total_processed"])
+            return jsonify(result), status
             
-            with get_db_connection() as conn:
-                for card in cards:
-                    # Map uz->ru format to front->back
-                    front = card.get('uz', '')
-                    back = card.get('ru', '')
-                    note = card.get('note', '')
-                    
-                    if front and back:
-                        # Add note to back if exists
-                        if note:
-                            back = f"{back}\n\n💡 {note}"
-                            
-                        # Check if card already exists for this user
-                        existing = conn.execute(
-                            "SELECT id FROM cards WHERE user_id = ? AND front = ? AND back = ?",
-                            (user_id, front, back)
-                        ).fetchone()
-                        
-                        if not existing:
-                            conn.execute(
-                                "INSERT INTO cards (user_id, front, back) VALUES (?, ?, ?)",
-                                (user_id, front, back)
-                            )
-                            created_count += 1
-                
-                conn.commit()
-            
-            app.logger.info("BULK_CREATE user_id=%s created=%s total_cards=%s", user_id, created_count, len(cards))
-            return jsonify({
-                "ok": True, 
-                "created": created_count, 
-                "total_processed": len(cards),
-                "skipped": len(cards) - created_count
-            })
-            
-        except json.JSONDecodeError:
-            app.logger.error("BULK_CREATE invalid JSON in new_words.json")
-            return jsonify({"ok": False, "error": "Invalid JSON format"}), 400
         except Exception as e:
             app.logger.error("BULK_CREATE error user_id=%s: %s", user_id, e)
             return jsonify({"ok": False, "error": "server error"}), 500
@@ -253,12 +262,13 @@ def create_app() -> Flask:
         """Initialize user and return dashboard data"""
         user_id = extract_user_id_from_request()
         if user_id is None:
-            app.logger.warning("USER_INIT unauthorized headers=%s body=%s", dict(request.headers), _safe_body())
+            if app.logger.isEnabledFor(logging.WARNING):
+                app.logger.warning("USER_INIT unauthorized headers=%s body=%s", dict(request.headers), _safe_body())
             return jsonify({"ok": False, "error": "unauthorized"}), 401
             
         try:
             # Extract user profile data from request
-            data = request.get_json() or {}
+            data = _request_payload()
             username = data.get("username")
             first_name = data.get("first_name")
             
@@ -281,32 +291,17 @@ def create_app() -> Flask:
     def api_get_settings():
         """Get user notification settings"""
         user_id = extract_user_id_from_request()
+        # The bot names the user in the query string and signs the call with its service key
+        if user_id is None and "user_id" in request.args and is_service_request():
+            user_id = request.args.get("user_id", type=int)
         if user_id is None:
             return jsonify({"ok": False, "error": "unauthorized"}), 401
             
         try:
-            with get_db_connection() as conn:
-                settings = conn.execute("""
-                    SELECT notifications_enabled, study_reminder_time, timezone 
-                    FROM user_settings WHERE user_id = ?
-                """, (user_id,)).fetchone()
-                
-                if settings:
-                    result = {
-                        "notifications_enabled": bool(settings["notifications_enabled"]),
-                        "study_reminder_time": settings["study_reminder_time"],
-                        "timezone": settings["timezone"]
-                    }
-                else:
-                    # Return default settings
-                    result = {
-                        "notifications_enabled": True,
-                        "study_reminder_time": "09:00",
-                        "timezone": "UTC"
-                    }
-                
-                app.logger.info("GET_SETTINGS user_id=%s", user_id)
-                return jsonify({"ok": True, "settings": result})
+            result = get_user_settings(user_id)
+            
+            app.logger.info("GET_SETTINGS user_id=%s", user_id)
+            return jsonify({"ok": True, "settings": result})
                 
         except Exception as e:
             app.logger.error("GET_SETTINGS error user_id=%s: %s", user_id, e)
@@ -320,29 +315,16 @@ def create_app() -> Flask:
             return jsonify({"ok": False, "error": "unauthorized"}), 401
             
         try:
-            data = request.get_json()
+            data = _request_payload()
             notifications_enabled = data.get("notifications_enabled", True)
             study_reminder_time = data.get("study_reminder_time", "09:00")
             timezone = data.get("timezone", "UTC")
             
-            # Validate time format
             try:
-                datetime.strptime(study_reminder_time, '%H:%M')
+                update_user_settings(user_id, notifications_enabled, study_reminder_time, timezone)
             except ValueError:
                 return jsonify({"ok": False, "error": "Invalid time format. Use HH:MM"}), 400
             
-            ensure_user_exists(user_id)
-            
-            with get_db_connection() as conn:
-                # Insert or update settings
-                conn.execute("""
-                    INSERT OR REPLACE INTO user_settings 
-                    (user_id, notifications_enabled, study_reminder_time, timezone)
-                    VALUES (?, ?, ?, ?)
-                """, (user_id, notifications_enabled, study_reminder_time, timezone))
-                
-                conn.commit()
-            
             app.logger.info("UPDATE_SETTINGS user_id=%s enabled=%s time=%s", 
                            user_id, notifications_enabled, study_reminder_time)
             return jsonify({"ok": True, "message": "Settings updated"})
@@ -378,6 +360,9 @@ def init_db() -> None:
                 front TEXT NOT NULL,
                 back TEXT NOT NULL,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                next_review_date DATE,
+                interval_days INTEGER,
+                ease_factor REAL,
                 FOREIGN KEY (user_id) REFERENCES users(user_id)
             )
             """
@@ -400,6 +385,39 @@ def init_db() -> None:
             """
         )
         
+        # Current SR state lives on cards (NULL next_review_date = never studied); study_sessions is
+        # the review history. Older databases get the columns added and filled from the latest session.
+        card_columns = {row[1] for row in conn.execute("PRAGMA table_info(cards)")}
+        if "next_review_date" not in card_columns:
+            conn.execute("ALTER TABLE cards ADD COLUMN next_review_date DATE")
+            conn.execute("ALTER TABLE cards ADD COLUMN interval_days INTEGER")
+            conn.execute("ALTER TABLE cards ADD COLUMN ease_factor REAL")
+            conn.execute(
+                """
+                UPDATE cards SET (next_review_date, interval_days, ease_factor) = (
+                    SELECT next_review_date, interval_days, ease_factor FROM study_sessions
+                    WHERE card_id = cards.id ORDER BY id DESC LIMIT 1
+                )
+                """
+            )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_cards_user_due ON cards(user_id, next_review_date)"
+        )
+        
+        # Latest session per card is a single descent of this index. Per-user card lookups use
+        # the user_id prefix of idx_cards_user_due / idx_cards_user_front_back, so the older
+        # single-column and (card_id, next_review_date) indexes are dropped.
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_ss_card_id_id ON study_sessions(card_id, id DESC)"
+        )
+        conn.execute("DROP INDEX IF EXISTS idx_cards_user")
+        conn.execute("DROP INDEX IF EXISTS idx_ss_card_date")
+        
+        # Lookup index for the duplicate check in import_new_words
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_cards_user_front_back ON cards(user_id, front, back)"
+        )
+        
         conn.execute(
             """
             CREATE TABLE IF NOT EXISTS user_settings (
@@ -412,44 +430,83 @@ def init_db() -> None:
             """
         )
         
+        # Scheduler spam protection: one row per user per day a reminder was sent
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS reminder_log (
+                user_id INTEGER NOT NULL,
+                sent_date TEXT NOT NULL,
+                PRIMARY KEY (user_id, sent_date)
+            ) WITHOUT ROWID
+            """
+        )
+        
         conn.commit()
 
 
+_db_local = threading.local()
+_db_connections = []
+
+
 def get_db_connection():
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
+    """Per-thread connection, opened once and reused across requests"""
+    # `with conn:` only commits/rolls back, so page and statement caches survive between calls
+    conn = getattr(_db_local, "conn", None)
+    if conn is None:
+        # check_same_thread=False only so the atexit hook can close it; each thread still uses its own
+        conn = sqlite3.connect(DB_PATH, cached_statements=128, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-64000")
+        conn.execute("PRAGMA mmap_size=268435456")
+        _db_local.conn = conn
+        _db_connections.append(conn)
     return conn
 
 
+@atexit.register
+def _close_db_connections() -> None:
+    while _db_connections:
+        try:
+            _db_connections.pop().close()
+        except sqlite3.Error:
+            pass
+
+
 def ensure_user_exists(user_id: int, username: str = None, first_name: str = None) -> None:
     """Ensure user exists in users table with optional profile info"""
     with get_db_connection() as conn:
-        # Check if user already exists
-        existing = conn.execute("SELECT user_id FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        _ensure_user(conn, user_id, username, first_name)
+
+
+def _ensure_user(conn: sqlite3.Connection, user_id: int, username: str = None, first_name: str = None) -> None:
+    """ensure_user_exists() inside the caller's transaction; the caller commits"""
+    # Check if user already exists
+    existing = conn.execute("SELECT user_id FROM users WHERE user_id = ?", (user_id,)).fetchone()
+    
+    if not existing:
+        # Create new user
+        conn.execute(
+            "INSERT INTO users (user_id, username, first_name) VALUES (?, ?, ?)",
+            (user_id, username, first_name)
+        )
         
-        if not existing:
-            # Create new user
-            conn.execute(
-                "INSERT INTO users (user_id, username, first_name) VALUES (?, ?, ?)",
-                (user_id, username, first_name)
-            )
-            
-            # Create default settings
+        # Create default settings
+        conn.execute(
+            "INSERT INTO user_settings (user_id, notifications_enabled, study_reminder_time, timezone) VALUES (?, ?, ?, ?)",
+            (user_id, True, "09:00", "UTC")
+        )
+        
+        logging.getLogger(__name__).info(f"Created new user: {user_id} ({first_name})")
+    else:
+        # Update profile info if provided
+        if username or first_name:
             conn.execute(
-                "INSERT INTO user_settings (user_id, notifications_enabled, study_reminder_time, timezone) VALUES (?, ?, ?, ?)",
-                (user_id, True, "09:00", "UTC")
+                "UPDATE users SET username = COALESCE(?, username), first_name = COALESCE(?, first_name) WHERE user_id = ?",
+                (username, first_name, user_id)
             )
-            
-            conn.commit()
-            logging.getLogger(__name__).info(f"Created new user: {user_id} ({first_name})")
-        else:
-            # Update profile info if provided
-            if username or first_name:
-                conn.execute(
-                    "UPDATE users SET username = COALESCE(?, username), first_name = COALESCE(?, first_name) WHERE user_id = ?",
-                    (username, first_name, user_id)
-                )
-                conn.commit()
 
 
 def get_user_dashboard_stats(user_id: int) -> dict:
@@ -457,54 +514,23 @@ def get_user_dashboard_stats(user_id: int) -> dict:
     with get_db_connection() as conn:
         today = date.today().isoformat()
         
-        # Basic card counts
-        total_cards = conn.execute("SELECT COUNT(*) as count FROM cards WHERE user_id = ?", (user_id,)).fetchone()["count"]
-        
-        # Due cards
-        due_cards = conn.execute("""
-            SELECT COUNT(DISTINCT c.id) as count
-            FROM cards c
-            JOIN study_sessions s ON c.id = s.card_id
-            WHERE c.user_id = ? AND s.next_review_date <= ?
-            AND s.id IN (
-                SELECT MAX(id) FROM study_sessions 
-                WHERE card_id = c.id GROUP BY card_id
-            )
-        """, (user_id, today)).fetchone()["count"]
-        
-        # New cards (never studied)
-        new_cards = conn.execute("""
-            SELECT COUNT(*) as count FROM cards c 
-            LEFT JOIN study_sessions s ON c.id = s.card_id 
-            WHERE c.user_id = ? AND s.card_id IS NULL
-        """, (user_id,)).fetchone()["count"]
-        
-        # Learning cards (studied but not mastered, interval < 21 days)
-        learning_cards = conn.execute("""
-            SELECT COUNT(DISTINCT c.id) as count
-            FROM cards c
-            JOIN study_sessions s ON c.id = s.card_id
-            WHERE c.user_id = ? 
-            AND s.interval_days < 21
-            AND s.next_review_date > ?
-            AND s.id IN (
-                SELECT MAX(id) FROM study_sessions 
-                WHERE card_id = c.id GROUP BY card_id
-            )
-        """, (user_id, today)).fetchone()["count"]
-        
-        # Mature cards (interval >= 21 days)
-        mature_cards = conn.execute("""
-            SELECT COUNT(DISTINCT c.id) as count
-            FROM cards c
-            JOIN study_sessions s ON c.id = s.card_id
-            WHERE c.user_id = ? 
-            AND s.interval_days >= 21
-            AND s.id IN (
-                SELECT MAX(id) FROM study_sessions 
-                WHERE card_id = c.id GROUP BY card_id
-            )
-        """, (user_id,)).fetchone()["count"]
+        # Card counts by SR state: new (never studied), due, learning (studied but not mastered,
+        # interval < 21 days) and mature (interval >= 21 days), in one scan of the user's cards
+        counts = conn.execute("""
+            SELECT
+                COUNT(*) as total,
+                COUNT(CASE WHEN next_review_date IS NULL THEN 1 END) as new,
+                COUNT(CASE WHEN next_review_date <= ? THEN 1 END) as due,
+                COUNT(CASE WHEN interval_days < 21 AND next_review_date > ? THEN 1 END) as learning,
+                COUNT(CASE WHEN interval_days >= 21 THEN 1 END) as mature
+            FROM cards
+            WHERE user_id = ?
+        """, (today, today, user_id)).fetchone()
+        total_cards = counts["total"]
+        new_cards = counts["new"]
+        due_cards = counts["due"]
+        learning_cards = counts["learning"]
+        mature_cards = counts["mature"]
         
         # Total study sessions
         total_sessions = conn.execute("""
@@ -565,37 +591,11 @@ def get_user_dashboard_stats(user_id: int) -> dict:
         }
 
 
-def calculate_sm2_interval(quality: int, interval_days: int, ease_factor: float) -> Tuple[int, float]:
-    """
-    SM-2 Algorithm for spaced repetition
-    quality: 1-5 (how well user remembered the card)
-    interval_days: current interval in days
-    ease_factor: current ease factor (starts at 2.5)
-    
-    Returns: (new_interval_days, new_ease_factor)
-    """
-    if quality < 3:
-        # Reset interval if quality is poor
-        new_interval = 1
-        new_ease_factor = ease_factor
-    else:
-        if interval_days == 1:
-            new_interval = 6
-        elif interval_days == 6:
-            new_interval = 16
-        else:
-            new_interval = int(interval_days * ease_factor)
-        
-        # Update ease factor
-        new_ease_factor = max(1.3, ease_factor + (0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02)))
-    
-    return new_interval, new_ease_factor
-
-
 def create_card(user_id: int, front: str, back: str) -> int:
     """Create a new flashcard"""
-    ensure_user_exists(user_id)
     with get_db_connection() as conn:
+        # User row and card go in one transaction
+        _ensure_user(conn, user_id)
         cur = conn.execute(
             "INSERT INTO cards (user_id, front, back) VALUES (?, ?, ?)",
             (user_id, front, back)
@@ -662,24 +662,17 @@ def get_cards_for_review(user_id: int, limit: int = 10) -> list:
     with get_db_connection() as conn:
         # Get new cards (never studied)
         new_cards = conn.execute("""
-            SELECT c.id, c.front, c.back, 'new' as status
-            FROM cards c 
-            LEFT JOIN study_sessions s ON c.id = s.card_id 
-            WHERE c.user_id = ? AND s.card_id IS NULL
+            SELECT id, front, back, 'new' as status
+            FROM cards
+            WHERE user_id = ? AND next_review_date IS NULL
             LIMIT ?
         """, (user_id, limit // 2)).fetchall()
         
-        # Get due cards
+        # Get due cards, a range scan on idx_cards_user_due
         due_cards = conn.execute("""
-            SELECT DISTINCT c.id, c.front, c.back, 'due' as status
-            FROM cards c
-            JOIN study_sessions s ON c.id = s.card_id
-            WHERE c.user_id = ? 
-            AND s.next_review_date <= ?
-            AND s.id IN (
-                SELECT MAX(id) FROM study_sessions 
-                WHERE card_id = c.id GROUP BY card_id
-            )
+            SELECT id, front, back, 'due' as status
+            FROM cards
+            WHERE user_id = ? AND next_review_date <= ?
             LIMIT ?
         """, (user_id, today, limit - len(new_cards))).fetchall()
         
@@ -687,68 +680,202 @@ def get_cards_for_review(user_id: int, limit: int = 10) -> list:
 
 
 def review_card(user_id: int, card_id: int, quality: int) -> bool:
-    """Record a review session for a card"""
+    """Record a review session for a card, returns False if the user has no such card"""
     with get_db_connection() as conn:
-        # Get the last review session for this card
-        last_session = conn.execute("""
-            SELECT interval_days, ease_factor FROM study_sessions 
-            WHERE card_id = ? AND user_id = ?
-            ORDER BY id DESC LIMIT 1
-        """, (card_id, user_id)).fetchone()
+        return _review_card(conn, user_id, card_id, quality)
+
+
+def _review_card(conn: sqlite3.Connection, user_id: int, card_id: int, quality: int) -> bool:
+    """review_card() inside the caller's transaction; the caller commits"""
+    # SM-2 applied in place to the card's current state (new cards start at 1 day / 2.5):
+    # quality < 3 resets the interval to 1 day and keeps the ease factor, otherwise the
+    # interval goes 1 -> 6 -> 16 -> interval * ease and the ease factor is adjusted (min 1.3)
+    new_state = conn.execute("""
+        WITH old AS (
+            SELECT COALESCE(interval_days, 1) AS i, COALESCE(ease_factor, 2.5) AS e
+            FROM cards WHERE id = :card_id AND user_id = :user_id
+        ), new AS (
+            SELECT
+                CASE WHEN :quality < 3 THEN 1
+                     WHEN i = 1 THEN 6
+                     WHEN i = 6 THEN 16
+                     ELSE CAST(i * e AS INTEGER) END AS i,
+                CASE WHEN :quality < 3 THEN e
+                     ELSE MAX(1.3, e + (0.1 - (5 - :quality) * (0.08 + (5 - :quality) * 0.02))) END AS e
+            FROM old
+        )
+        UPDATE cards SET (interval_days, ease_factor, next_review_date) = (
+            SELECT i, e, date(:today, '+' || i || ' days') FROM new
+        )
+        WHERE id = :card_id AND user_id = :user_id
+        RETURNING interval_days, ease_factor, next_review_date
+    """, {"card_id": card_id, "user_id": user_id, "quality": quality,
+          "today": date.today().isoformat()}).fetchone()
+    
+    if new_state is None:
+        return False
+    
+    # Keep the review history
+    conn.execute("""
+        INSERT INTO study_sessions 
+        (card_id, user_id, quality, interval_days, ease_factor, next_review_date)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, (card_id, user_id, quality, *new_state))
+    
+    return True
+
+
+def review_cards_bulk(reviews: list) -> list:
+    """Record several reviews in one transaction, returns a success flag per item"""
+    results = []
+    with get_db_connection() as conn:
+        for item in reviews:
+            try:
+                user_id = int(item["user_id"])
+                card_id = int(item["card_id"])
+                quality = int(item["quality"])
+            except (KeyError, TypeError, ValueError):
+                results.append(False)
+                continue
+                
+            if not (1 <= quality <= 5):
+                results.append(False)
+                continue
+                
+            results.append(_review_card(conn, user_id, card_id, quality))
+    return results
+
+
+def import_new_words(user_id: int) -> Tuple[dict, int]:
+    """Create the user's cards from new_words.json, returns (response body, HTTP status)"""
+    words_file_path = os.path.join(os.path.dirname(BASE_DIR), "new_words.json")
+    
+    if not os.path.exists(words_file_path):
+        return {"ok": False, "error": "new_words.json file not found"}, 404
         
-        if last_session:
-            interval_days, ease_factor = last_session["interval_days"], last_session["ease_factor"]
-        else:
-            interval_days, ease_factor = 1, 2.5
+    with open(words_file_path, 'r', encoding='utf-8') as f:
+        words_json = f.read()
+    
+    # The file goes to SQLite as text; JSON1 parses it, so no per-card Python objects are built
+    with get_db_connection() as conn:
+        is_valid, total_cards = conn.execute(
+            "SELECT json_valid(?1), CASE WHEN json_valid(?1) THEN json_array_length(?1, '$.cards') END",
+            (words_json,)
+        ).fetchone()
+        if not is_valid:
+            return {"ok": False, "error": "Invalid JSON format"}, 400
+        # NULL when there is no "cards" key, 0 when it is empty or not an array
+        if not total_cards:
+            return {"ok": False, "error": "No cards found in file"}, 400
         
-        # Calculate new interval using SM-2
-        new_interval, new_ease_factor = calculate_sm2_interval(quality, interval_days, ease_factor)
-        next_review_date = (date.today() + timedelta(days=new_interval)).isoformat()
+        _ensure_user(conn, user_id)
+        # Map uz->ru format to front->back, adding the note to back if it exists; duplicates in the
+        # file collapse via GROUP BY (kept in file order), existing cards via idx_cards_user_front_back
+        cur = conn.execute(
+            """
+            INSERT INTO cards (user_id, front, back)
+            SELECT :user_id, front, back FROM (
+                SELECT
+                    CAST(key AS INTEGER) AS idx,
+                    json_extract(value, '$.uz') AS front,
+                    CASE WHEN json_extract(value, '$.ru') != '' THEN
+                        json_extract(value, '$.ru')
+                        || COALESCE(char(10, 10) || '💡 ' || NULLIF(json_extract(value, '$.note'), ''), '')
+                    END AS back
+                FROM json_each(:words, '$.cards')
+            ) AS words
+            WHERE front != '' AND back IS NOT NULL
+            AND NOT EXISTS (
+                SELECT 1 FROM cards c WHERE c.user_id = :user_id AND c.front = words.front AND c.back = words.back
+            )
+            GROUP BY front, back
+            ORDER BY MIN(idx)
+            """,
+            {"user_id": user_id, "words": words_json}
+        )
+        created_count = cur.rowcount
+    
+    return {
+        "ok": True, 
+        "created": created_count, 
+        "total_processed": total_cards,
+        "skipped": total_cards - created_count
+    }, 200
+
+
+def get_user_settings(user_id: int) -> dict:
+    """Get user notification settings, defaults when none are stored"""
+    with get_db_connection() as conn:
+        settings = conn.execute("""
+            SELECT notifications_enabled, study_reminder_time, timezone 
+            FROM user_settings WHERE user_id = ?
+        """, (user_id,)).fetchone()
         
-        # Insert new review session
+    if settings:
+        return {
+            "notifications_enabled": bool(settings["notifications_enabled"]),
+            "study_reminder_time": settings["study_reminder_time"],
+            "timezone": settings["timezone"]
+        }
+    # Return default settings
+    return {
+        "notifications_enabled": True,
+        "study_reminder_time": "09:00",
+        "timezone": "UTC"
+    }
+
+
+def update_user_settings(user_id: int, notifications_enabled: bool = True,
+                         study_reminder_time: str = "09:00", timezone: str = "UTC") -> None:
+    """Insert or replace user notification settings, raises ValueError on a bad HH:MM time"""
+    # Validate time format
+    datetime.strptime(study_reminder_time, '%H:%M')
+    
+    with get_db_connection() as conn:
+        _ensure_user(conn, user_id)
+        # Insert or update settings
         conn.execute("""
-            INSERT INTO study_sessions 
-            (card_id, user_id, quality, interval_days, ease_factor, next_review_date)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, (card_id, user_id, quality, new_interval, new_ease_factor, next_review_date))
+            INSERT OR REPLACE INTO user_settings 
+            (user_id, notifications_enabled, study_reminder_time, timezone)
+            VALUES (?, ?, ?, ?)
+        """, (user_id, notifications_enabled, study_reminder_time, timezone))
         
         conn.commit()
-        return True
 
 
 def get_user_stats(user_id: int) -> dict:
     """Get user study statistics"""
     with get_db_connection() as conn:
-        total_cards = conn.execute("SELECT COUNT(*) as count FROM cards WHERE user_id = ?", (user_id,)).fetchone()["count"]
-        
         today = date.today().isoformat()
-        due_today = conn.execute("""
-            SELECT COUNT(DISTINCT c.id) as count
-            FROM cards c
-            JOIN study_sessions s ON c.id = s.card_id
-            WHERE c.user_id = ? AND s.next_review_date <= ?
-            AND s.id IN (
-                SELECT MAX(id) FROM study_sessions 
-                WHERE card_id = c.id GROUP BY card_id
-            )
-        """, (user_id, today)).fetchone()["count"]
-        
-        new_cards = conn.execute("""
-            SELECT COUNT(*) as count FROM cards c 
-            LEFT JOIN study_sessions s ON c.id = s.card_id 
-            WHERE c.user_id = ? AND s.card_id IS NULL
-        """, (user_id,)).fetchone()["count"]
+        counts = conn.execute("""
+            SELECT
+                COUNT(*) as total,
+                COUNT(CASE WHEN next_review_date <= ? THEN 1 END) as due,
+                COUNT(CASE WHEN next_review_date IS NULL THEN 1 END) as new
+            FROM cards
+            WHERE user_id = ?
+        """, (today, user_id)).fetchone()
         
         return {
-            "total_cards": total_cards,
-            "due_today": due_today,
-            "new_cards": new_cards
+            "total_cards": counts["total"],
+            "due_today": counts["due"],
+            "new_cards": counts["new"]
         }
 
 
 def extract_user_id_from_request() -> Optional[int]:
     """Extract user ID from Telegram initData or dev mode fallback"""
     logger = logging.getLogger(__name__)
+    dev_mode = (os.getenv("DEV_MODE", "false").lower() == "true")
+    
+    # Dev mode with a valid ?user_id= needs neither initData nor the request body
+    if dev_mode and request.args.get("user_id") is not None:
+        try:
+            val = int(request.args["user_id"])
+            logger.info("AUTH: DEV mode user_id=%s", val)
+            return val
+        except ValueError:
+            pass  # Handled (and logged) by the dev-mode branch below
     
     # Parse request payload
     content_type = (request.headers.get("Content-Type") or "").lower()
@@ -760,10 +887,11 @@ def extract_user_id_from_request() -> Optional[int]:
             payload = {}
     else:
         payload = request.form.to_dict() if request.form else {}
+    # Keep the parsed payload for _safe_body() so unauthorized logging doesn't parse again
+    request.environ['__payload'] = payload
 
     init_data = request.headers.get("X-Telegram-Init-Data") or payload.get("initData")
     bot_token = os.getenv("BOT_TOKEN")
-    dev_mode = (os.getenv("DEV_MODE", "false").lower() == "true")
     
     logger.info("AUTH: dev_mode=%s, has_initData=%s, has_bot_token=%s", 
                 dev_mode, bool(init_data), bool(bot_token))
@@ -781,12 +909,12 @@ def extract_user_id_from_request() -> Optional[int]:
     if dev_mode:
         uid = request.args.get("user_id") or payload.get("user_id")
         try:
-            val = int(uid) if uid is not None else 234195742  # Default dev user ID
+            val = int(uid) if uid is not None else DEV_DEFAULT_USER_ID
             logger.info("AUTH: DEV mode user_id=%s", val)
             return val
         except (TypeError, ValueError):
             logger.warning("AUTH: Invalid DEV user_id=%r, using default", uid)
-            return 234195742
+            return DEV_DEFAULT_USER_ID
 
     # Production fallback: try to extract user_id from payload for API compatibility
     if not dev_mode and payload.get("user_id"):
@@ -801,45 +929,90 @@ def extract_user_id_from_request() -> Optional[int]:
     return None
 
 
+@functools.lru_cache(maxsize=4)
+def service_key(bot_token: str) -> str:
+    """Key the bot sends in X-Service-Key for service calls, derived from the shared bot token"""
+    # Keep in sync with API_SERVICE_KEY in bot/bot.py
+    return hmac.new(bot_token.encode(), b"api-service", hashlib.sha256).hexdigest()
+
+
+def is_service_request() -> bool:
+    """True for calls made by the bot itself (always true in DEV_MODE)"""
+    if os.getenv("DEV_MODE", "false").lower() == "true":
+        logging.getLogger(__name__).info("AUTH: DEV mode service request")
+        return True
+    bot_token = os.getenv("BOT_TOKEN")
+    key = request.headers.get("X-Service-Key")
+    if bot_token and key and hmac.compare_digest(key.encode(), service_key(bot_token).encode()):
+        logging.getLogger(__name__).info("AUTH: Success via service key")
+        return True
+    logging.getLogger(__name__).error("AUTH: Failed - no valid service key")
+    return False
+
+
+@functools.lru_cache(maxsize=4)
+def _init_data_hmac(bot_token: str) -> "hmac.HMAC":
+    """Keyed HMAC for the bot token, copied per request so the key is derived once"""
+    secret_key = hashlib.sha256(bot_token.encode()).digest()
+    return hmac.new(secret_key, digestmod=hashlib.sha256)
+
+
 def validate_and_get_user_id(init_data: str, bot_token: str) -> Tuple[bool, Optional[int]]:
+    ok, uid, auth_date = _check_init_data(init_data, bot_token)
+    # Checked on every call, so a cached signature check cannot outlive the freshness window
+    if not ok or time.time() - auth_date > INIT_DATA_MAX_AGE:
+        return False, None
+    return True, uid
+
+
+# The same signed initData string is sent with every request of a Mini App session, and the
+# result depends only on the arguments, so repeat requests skip the parse and HMAC entirely
+@functools.lru_cache(maxsize=4096)
+def _check_init_data(init_data: str, bot_token: str) -> Tuple[bool, Optional[int], int]:
+    """Signature check of initData, returning (ok, user_id, auth_date)"""
     try:
-        # Parse URL-encoded initData, extract hash, build data_check_string
-        parsed = urllib.parse.parse_qs(init_data, keep_blank_values=True)
-        data = {k: v[0] for k, v in parsed.items()}
+        # Single pass over the URL-encoded initData (first value wins, like parse_qs()[k][0])
+        data = {}
+        for part in init_data.split("&"):
+            if part:
+                key, _, value = part.partition("=")
+                data.setdefault(urllib.parse.unquote_plus(key), urllib.parse.unquote_plus(value))
         recv_hash = data.pop("hash", None)
         if not recv_hash:
-            return False, None
-
-        pairs = [f"{k}={data[k]}" for k in sorted(data.keys())]
-        data_check_string = "\n".join(pairs)
+            return False, None, 0
 
-        secret_key = hashlib.sha256(bot_token.encode()).digest()
-        calc_hash = hmac.new(secret_key, data_check_string.encode(), hashlib.sha256).hexdigest()
-        if calc_hash != recv_hash:
-            return False, None
+        # Feed the sorted "key=value" lines to the HMAC instead of joining a data_check_string
+        mac = _init_data_hmac(bot_token).copy()
+        for i, key in enumerate(sorted(data)):
+            if i:
+                mac.update(b"\n")
+            mac.update(f"{key}={data[key]}".encode())
+        if not hmac.compare_digest(mac.hexdigest(), recv_hash):
+            return False, None, 0
 
         user_json = data.get("user")
         if not user_json:
-            return False, None
-        user = json.loads(user_json)
+            return False, None, 0
+        user = orjson.loads(user_json)
         uid = int(user.get("id"))
-        return True, uid
+        return True, uid, int(data["auth_date"])
     except Exception:
-        return False, None
+        return False, None, 0
 
 
-
-
-# Create app instance for WSGI servers like gunicorn
-app = create_app()
-
-if __name__ == "__main__":
-    app.run(host="127.0.0.1", port=8000, debug=True)
+def _request_payload() -> dict:
+    """Body already parsed by extract_user_id_from_request(), so handlers don't parse it again"""
+    payload = request.environ.get('__payload')
+    if payload is None:
+        payload = request.get_json(silent=True) or {}
+    return payload
 
 
 def _safe_body():
     try:
-        data = request.get_json(silent=True)
+        data = request.environ.get('__payload')
+        if data is None:
+            data = request.get_json(silent=True)
         if data is None:
             return None
         data = dict(data)
@@ -847,3 +1020,10 @@ def _safe_body():
         return data
     except Exception:
         return None
+
+
+# Create app instance for WSGI servers like gunicorn
+app = create_app()
+
+if __name__ == "__main__":
+    app.run(host="127.0.0.1", port=8000, debug=True)